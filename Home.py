@@ -1,9 +1,10 @@
 import streamlit as st
-from sqlmodel import select
 import pandas as pd
+from src import queries
 from src.database import init_db, get_session
-from src.models import Transaction, Category, Budget
 from src.analytics import create_sankey, create_bullet_chart
+from src.cache import cached
+from src.money import EXPONENT, SCALE
 from datetime import datetime
 import altair as alt
 
@@ -36,50 +37,28 @@ selected_month = st.sidebar.selectbox(
 
 def get_data(month, year):
     with get_session() as session:
-        # Fetch Transactions (Monthly)
-        query_tx = (
-            select(
-                Transaction,
-                Category.name.label("category_name"),
-                Category.group,
-                Category.type,
-            )
-            .join(Category)
-            .where(Transaction.date.contains(f"{year}-{month:02d}"))
-        )
-        tx_results = session.exec(query_tx).all()
-
-        # Fetch Budgets (Global - No Date Filter)
-        query_bd = select(Budget, Category.name.label("category_name")).join(Category)
-        bd_results = session.exec(query_bd).all()
-
-    return tx_results, bd_results
-
-
-tx_data, bd_data = get_data(selected_month, selected_year)
-
-# Convert to DataFrames
-if tx_data:
-    clean_data = []
-    for t, cat_name, cat_group, cat_type in tx_data:
-        row = t.model_dump()
-        row["category_name"] = cat_name
-        row["group"] = cat_group
-        row["type"] = "Income" if t.amount > 0 else "Expense"
-        clean_data.append(row)
-    df_tx = pd.DataFrame(clean_data)
-else:
-    df_tx = pd.DataFrame(columns=["amount", "type", "category_name", "group"])
-
-if bd_data:
-    clean_bd = []
-    for b, cat_name in bd_data:
-        row = b.model_dump()
-        row["category_name"] = cat_name
-        clean_bd.append(row)
-    df_bd = pd.DataFrame(clean_bd)
-else:
-    df_bd = pd.DataFrame(columns=["category_name", "amount"])
+        # Monthly totals per category from the trigger-maintained summary,
+        # so the cost does not grow with the length of the history
+        df_tx = queries.month_category_totals(session, year, month)
+        # Budgets are global (no date filter)
+        df_bd = queries.budgets(session)
+    return df_tx, df_bd
+
+
+@cached()
+def spending_flow(month, year):
+    """Sankey of the month's expenses, rebuilt only after data changes."""
+    df_tx, _ = get_data(month, year)
+    expenses_df = df_tx[
+        ~df_tx["category_name"].isin(["Transfer"]) & (df_tx["amount"] < 0)
+    ].copy()
+    if expenses_df.empty:
+        return None
+    expenses_df["amount"] = expenses_df["amount"].abs()
+    return create_sankey(expenses_df)
+
+
+df_tx, df_bd = get_data(selected_month, selected_year)
 
 # --- KPI Metrics ---
 col1, col2, col3 = st.columns(3)
@@ -89,8 +68,9 @@ excluded_cats = ["Transfer"]
 mask_real = ~df_tx["category_name"].isin(excluded_cats + ["Investments"])
 df_real = df_tx[mask_real]
 
-total_income = df_real[df_real["amount"] > 0]["amount"].sum()
-total_spend_actual = df_real[df_real["amount"] < 0]["amount"].sum()
+# Totals of exact SQL sums; rounding drops float noise from adding them
+total_income = round(df_real.loc[df_real["amount"] > 0, "amount"].sum(), EXPONENT)
+total_spend_actual = round(df_real.loc[df_real["amount"] < 0, "amount"].sum(), EXPONENT)
 savings_rate = (
     ((total_income + total_spend_actual) / total_income * 100)
     if total_income > 0
@@ -150,10 +130,8 @@ st.divider()
 
 # --- 1. SPENDING FLOW (Sankey) ---
 st.subheader("Spending Flow")
-expenses_df = df_real[df_real["amount"] < 0].copy()
-if not expenses_df.empty:
-    expenses_df["amount"] = expenses_df["amount"].abs()
-    fig_sankey = create_sankey(expenses_df)
+fig_sankey = spending_flow(selected_month, selected_year)
+if fig_sankey is not None:
     st.plotly_chart(fig_sankey, use_container_width=True)
 else:
     st.info("No expense data found.")
@@ -192,7 +170,9 @@ if not merged.empty:
     rows_to_display = []
     for index, row in merged.iterrows():
         # Toggle Logic
-        if hide_exact and abs(row["amount"] - row["budget"]) < 0.01:
+        # Compared in minor units: the pandas sums are floats
+        exact = round(row["amount"] * SCALE) == round(row["budget"] * SCALE)
+        if hide_exact and exact:
             continue
         # Show if there is budget OR spending
         if row["budget"] > 0 or row["amount"] > 0:
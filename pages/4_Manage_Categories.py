@@ -1,164 +1,329 @@
 import streamlit as st
 from src.database import get_session
-from src.models import Category, CategoryRule, Transaction
-from sqlmodel import select
+from src.models import Budget, Category, CategoryRule, Transaction
+from src.recategorize import affected_by, apply_rules
+from src import queries
+from src.rules import (
+    changed_keywords,
+    dry_run,
+    get_rule_engine,
+    profile_rules,
+    regex_problem,
+)
+from sqlmodel import delete, select, update
 import pandas as pd
-import re
 
 st.set_page_config(page_title="Settings", layout="wide")
 st.title("⚙️ System Settings")
 
-session = get_session()
-tab1, tab2 = st.tabs(["🗂️ Categories", "🤖 Automation Rules"])
-
-
-# --- HELPER FUNCTION ---
-def clean_val(value):
-    if isinstance(value, list):
-        return str(value[0]) if len(value) > 0 else None
-    if pd.isna(value):
-        return None
-    return str(value)
-
-
-# --- TAB 1: CATEGORIES ---
-with tab1:
-    st.subheader("Manage Categories")
-    categories = session.exec(select(Category)).all()
-    cat_data = [c.model_dump() for c in categories]
-    df_cat = pd.DataFrame(cat_data)
-
-    if df_cat.empty:
-        df_cat = pd.DataFrame(columns=["name", "group", "type"])
-
-    edited_cat = st.data_editor(
-        df_cat,
-        num_rows="dynamic",
-        column_config={
-            "id": None,
-            "name": "Category Name",
-            "group": st.column_config.SelectboxColumn(
-                "Group", options=["Needs", "Wants", "Savings", "Income"], required=True
-            ),
-            "type": st.column_config.SelectboxColumn(
-                "Type", options=["Expense", "Income"], required=True
-            ),
-        },
-        use_container_width=True,
-        key="cat_editor",
-    )
-
-    if st.button("Save Categories", type="primary"):
-        current_ids = [
-            row["id"] for i, row in edited_cat.iterrows() if pd.notna(row.get("id"))
-        ]
-        for c in categories:
-            if c.id not in current_ids:
-                session.delete(c)
-        for i, row in edited_cat.iterrows():
-            if pd.isna(row.get("id")):
-                session.add(
-                    Category(name=row["name"], group=row["group"], type=row["type"])
-                )
-            else:
-                existing = session.get(Category, int(row["id"]))
-                if existing:
-                    existing.name = row["name"]
-                    existing.group = row["group"]
-                    existing.type = row["type"]
-                    session.add(existing)
-        session.commit()
-        st.success("Categories Saved!")
-        st.rerun()
-
-
-# --- TAB 2: REGEX RULES ---
-with tab2:
-    st.subheader("Regex Automation")
-    st.info(
+with get_session() as session:
+    tab1, tab2 = st.tabs(["🗂️ Categories", "🤖 Automation Rules"])
+
+    # --- HELPER FUNCTION ---
+    def clean_val(value):
+        if isinstance(value, list):
+            return str(value[0]) if len(value) > 0 else None
+        if pd.isna(value):
+            return None
+        return str(value)
+
+    # --- TAB 1: CATEGORIES ---
+    with tab1:
+        st.subheader("Manage Categories")
+        categories = session.exec(select(Category)).all()
+        cat_data = [c.model_dump() for c in categories]
+        df_cat = pd.DataFrame(cat_data)
+
+        if df_cat.empty:
+            df_cat = pd.DataFrame(columns=["name", "group", "type"])
+
+        edited_cat = st.data_editor(
+            df_cat,
+            num_rows="dynamic",
+            column_config={
+                "id": None,
+                "name": "Category Name",
+                "group": st.column_config.SelectboxColumn(
+                    "Group",
+                    options=["Needs", "Wants", "Savings", "Income"],
+                    required=True,
+                ),
+                "type": st.column_config.SelectboxColumn(
+                    "Type", options=["Expense", "Income"], required=True
+                ),
+            },
+            use_container_width=True,
+            key="cat_editor",
+        )
+
+        if st.button("Save Categories", type="primary"):
+            current_ids = [
+                row["id"] for i, row in edited_cat.iterrows() if pd.notna(row.get("id"))
+            ]
+            uncat = next((c for c in categories if c.name == "Uncategorized"), None)
+            for c in categories:
+                if c.id not in current_ids:
+                    # Foreign keys are enforced: detach everything pointing here
+                    fallback_id = uncat.id if uncat and uncat.id != c.id else None
+                    session.exec(
+                        update(Transaction)
+                        .where(Transaction.category_id == c.id)
+                        .values(category_id=fallback_id)
+                    )
+                    session.exec(
+                        delete(CategoryRule).where(CategoryRule.category_id == c.id)
+                    )
+                    session.exec(delete(Budget).where(Budget.category_id == c.id))
+                    session.delete(c)
+            for i, row in edited_cat.iterrows():
+                if pd.isna(row.get("id")):
+                    session.add(
+                        Category(name=row["name"], group=row["group"], type=row["type"])
+                    )
+                else:
+                    existing = session.get(Category, int(row["id"]))
+                    if existing:
+                        existing.name = row["name"]
+                        existing.group = row["group"]
+                        existing.type = row["type"]
+                        session.add(existing)
+            session.commit()
+            st.success("Categories Saved!")
+            st.rerun()
+
+    # --- TAB 2: REGEX RULES ---
+    with tab2:
+        st.subheader("Regex Automation")
+        st.info(
+            """
+        💡 **Power User Mode:** Rules now use Regular Expressions.
+        - **Exact Match:** `^Amazon$` (Matches "Amazon" but NOT "Amazon Mktplace")
+        - **Start With:** `^Uber` (Matches "Uber Eats", "Uber Trip")
+        - **Contains (Standard):** `Netflix` (Matches "Netflix.com", "Paypal *Netflix")
+        - **Case Insensitive:** Logic is case-insensitive by default.
         """
-    💡 **Power User Mode:** Rules now use Regular Expressions.
-    - **Exact Match:** `^Amazon$` (Matches "Amazon" but NOT "Amazon Mktplace")
-    - **Start With:** `^Uber` (Matches "Uber Eats", "Uber Trip")
-    - **Contains (Standard):** `Netflix` (Matches "Netflix.com", "Paypal *Netflix")
-    - **Case Insensitive:** Logic is case-insensitive by default.
-    """
-    )
-
-    rules = session.exec(select(CategoryRule)).all()
-    rule_data = [r.model_dump() for r in rules]
-    df_rules = pd.DataFrame(rule_data)
-
-    cat_map = {c.name: c.id for c in categories}
-    cat_names = list(cat_map.keys())
-
-    if df_rules.empty:
-        df_rules = pd.DataFrame(columns=["keyword", "category_id"])
-
-    id_to_name = {v: k for k, v in cat_map.items()}
-    if "category_id" in df_rules.columns and not df_rules.empty:
-        df_rules["category_name"] = df_rules["category_id"].map(id_to_name)
-    else:
-        df_rules["category_name"] = None
-
-    edited_rules = st.data_editor(
-        df_rules,
-        num_rows="dynamic",
-        column_config={
-            "id": None,
-            "category_id": None,
-            "keyword": st.column_config.TextColumn("Regex Pattern", required=True),
-            "category_name": st.column_config.SelectboxColumn(
-                "Assign To", options=cat_names, required=True
-            ),
-        },
-        use_container_width=True,
-        key="rule_editor",
-    )
-
-    col_a, col_b = st.columns(2)
-
-    with col_a:
-        if st.button("Save Rules"):
-            for r in rules:
-                session.delete(r)
-
-            for i, row in edited_rules.iterrows():
+        )
+
+        rules = session.exec(select(CategoryRule)).all()
+        rule_data = [r.model_dump() for r in rules]
+        df_rules = pd.DataFrame(rule_data)
+
+        cat_map = {c.name: c.id for c in categories}
+        cat_names = list(cat_map.keys())
+
+        if df_rules.empty:
+            df_rules = pd.DataFrame(columns=["keyword", "category_id"])
+
+        id_to_name = {v: k for k, v in cat_map.items()}
+        if "category_id" in df_rules.columns and not df_rules.empty:
+            df_rules["category_name"] = df_rules["category_id"].map(id_to_name)
+        else:
+            df_rules["category_name"] = None
+
+        edited_rules = st.data_editor(
+            df_rules,
+            num_rows="dynamic",
+            column_config={
+                "id": None,
+                "category_id": None,
+                "keyword": st.column_config.TextColumn("Regex Pattern", required=True),
+                "category_name": st.column_config.SelectboxColumn(
+                    "Assign To", options=cat_names, required=True
+                ),
+            },
+            use_container_width=True,
+            key="rule_editor",
+        )
+
+        # --- DRY RUN ---
+        if st.button("🔍 Preview Edited Rules"):
+            candidate = []
+            for _, row in edited_rules.iterrows():
                 cat_val = clean_val(row.get("category_name"))
                 keyword = clean_val(row.get("keyword"))
-
                 if keyword and cat_val and cat_val in cat_map:
-                    # Validate Regex before saving
-                    try:
-                        re.compile(keyword)
-                        session.add(
-                            CategoryRule(keyword=keyword, category_id=cat_map[cat_val])
+                    candidate.append((keyword, cat_map[cat_val]))
+
+            # Preview what saving would keep: refused patterns are not run
+            refused = {kw for kw, _ in candidate if regex_problem(kw)}
+            for keyword in sorted(refused):
+                st.warning(f"❌ Would be skipped on save: {keyword}")
+            candidate = [rule for rule in candidate if rule[0] not in refused]
+            preview = dry_run(candidate, queries.description_categories(session))
+            st.metric("Transactions that would change category", preview.changed)
+            per_rule = preview.per_rule.assign(
+                category=preview.per_rule["category_id"].map(id_to_name)
+            )
+            st.dataframe(
+                per_rule[["keyword", "category", "hits", "changes", "problem"]],
+                column_config={
+                    "keyword": "Pattern",
+                    "category": "Assign To",
+                    "hits": "Would Categorize",
+                    "changes": "Would Change",
+                    "problem": "Problem",
+                },
+                hide_index=True,
+                use_container_width=True,
+            )
+            if not preview.samples.empty:
+                st.caption("Sample changes (nothing has been saved yet):")
+                samples = preview.samples
+                st.dataframe(
+                    pd.DataFrame(
+                        {
+                            "Description": samples["description"],
+                            "Transactions": samples["count"],
+                            "From": samples["category_id"]
+                            .map(id_to_name)
+                            .fillna("Uncategorized"),
+                            "To": samples["new_category_id"].map(id_to_name),
+                            "Rule": samples["keyword"],
+                        }
+                    ),
+                    hide_index=True,
+                    use_container_width=True,
+                )
+
+        col_a, col_b = st.columns(2)
+
+        with col_a:
+            if st.button("Save Rules"):
+                old_rules = [
+                    (r.keyword, r.category_id)
+                    for r in sorted(rules, key=lambda r: r.id)
+                ]
+                new_rules, skipped = [], []
+                for r in rules:
+                    session.delete(r)
+
+                for i, row in edited_rules.iterrows():
+                    cat_val = clean_val(row.get("category_name"))
+                    keyword = clean_val(row.get("keyword"))
+
+                    if keyword and cat_val and cat_val in cat_map:
+                        # Validate Regex before saving: invalid or
+                        # potentially catastrophic patterns are refused
+                        problem = regex_problem(keyword)
+                        if problem:
+                            skipped.append(f"❌ Regex skipped: {keyword} ({problem})")
+                        else:
+                            session.add(
+                                CategoryRule(
+                                    keyword=keyword, category_id=cat_map[cat_val]
+                                )
+                            )
+                            new_rules.append((keyword, cat_map[cat_val]))
+
+                session.commit()
+                # Remembered until the next apply, for the incremental mode
+                pending = set(st.session_state.get("changed_rule_keywords", []))
+                pending.update(changed_keywords(old_rules, new_rules))
+                st.session_state["changed_rule_keywords"] = sorted(pending)
+                st.success("Rules Saved!")
+                # Stay on this run so the skipped rules can be read
+                for message in skipped:
+                    st.error(message)
+                if not skipped:
+                    st.rerun()
+
+        with col_b:
+            # Edits are only tracked in this browser session: after a reload
+            # nothing is pending and the whole history has to be scanned
+            pending = st.session_state.get("changed_rule_keywords", [])
+            incremental = st.toggle(
+                "Only transactions affected by rule edits",
+                value=bool(pending),
+                disabled=not pending,
+                help=(
+                    f"{len(pending)} edited rule pattern(s) since the last apply."
+                    if pending
+                    else "No rule edits recorded in this session: "
+                    "applying scans the whole history."
+                ),
+            )
+            incremental = incremental and bool(pending)
+            if st.button("⚡ Apply Rules to Existing Transactions"):
+                affected = affected_by(session, pending) if incremental else None
+                if incremental and affected is None:
+                    st.session_state["changed_rule_keywords"] = []
+                    st.info("No transactions are affected by the edited rules.")
+                else:
+                    rule_engine = get_rule_engine(session)
+                    where = [] if affected is None else [affected]
+
+                    progress = st.progress(0.0, text="Applying rules...")
+
+                    def on_batch(done, total):
+                        progress.progress(
+                            done / total,
+                            text=f"Checked {done:,} of {total:,} transactions",
                         )
-                    except re.error:
-                        st.error(f"❌ Invalid Regex skipped: {keyword}")
 
-            session.commit()
-            st.success("Rules Saved!")
-            st.rerun()
+                    count = apply_rules(session, rule_engine, where, on_batch=on_batch)
+                    progress.progress(1.0, text="Done")
+                    st.session_state["changed_rule_keywords"] = []
+                    scope = (
+                        "Affected transactions" if incremental else "Scanned history"
+                    )
+                    st.success(f"{scope}: Updated {count} transactions!")
 
-    with col_b:
-        if st.button("⚡ Apply Rules to Existing Transactions"):
-            all_rules = session.exec(select(CategoryRule)).all()
-            all_tx = session.exec(select(Transaction)).all()
-            count = 0
-
-            for tx in all_tx:
-                for rule in all_rules:
-                    if rule.keyword:
-                        try:
-                            # REGEX MATCHING
-                            if re.search(rule.keyword, tx.description, re.IGNORECASE):
-                                if tx.category_id != rule.category_id:
-                                    tx.category_id = rule.category_id
-                                    session.add(tx)
-                                    count += 1
-                                break
-                        except re.error:
-                            pass  # Skip bad rules
-            session.commit()
-            st.success(f"Scanned history: Updated {count} transactions!")
+        # --- RULE PROFILE ---
+        st.divider()
+        st.subheader("📊 Rule Profile")
+        st.caption(
+            "How many transactions each rule categorizes, how long it takes, "
+            "and which rules never win because an earlier rule matches first."
+        )
+        if st.button("Profile Rules on History"):
+            saved_rules = session.exec(
+                select(CategoryRule).order_by(CategoryRule.id)
+            ).all()
+            texts = queries.description_counts(session)
+            profile = profile_rules(
+                [(r.keyword, r.category_id) for r in saved_rules],
+                texts["description"],
+                texts["count"],
+            )
+            profile["category"] = profile["category_id"].map(id_to_name)
+            st.dataframe(
+                profile[
+                    [
+                        "keyword",
+                        "category",
+                        "hits",
+                        "matches",
+                        "time_ms",
+                        "shadowed_by",
+                        "disabled",
+                        "problem",
+                    ]
+                ],
+                column_config={
+                    "keyword": "Pattern",
+                    "category": "Assign To",
+                    "hits": "Categorized",
+                    "matches": "Matched",
+                    "time_ms": st.column_config.NumberColumn(
+                        "Time (ms)", format="%.2f"
+                    ),
+                    "shadowed_by": "Shadowed By",
+                    "disabled": st.column_config.CheckboxColumn("Disabled"),
+                    "problem": "Problem",
+                },
+                hide_index=True,
+                use_container_width=True,
+            )
+            disabled = profile[profile["disabled"]]
+            if not disabled.empty:
+                st.error(
+                    f"{len(disabled)} rule(s) are disabled and never applied: "
+                    + ", ".join(f"`{kw}`" for kw in disabled["keyword"])
+                    + ". Fix or delete them above."
+                )
+            unused = profile[(profile["hits"] == 0) & ~profile["disabled"]]
+            if not unused.empty:
+                st.warning(
+                    f"{len(unused)} rule(s) categorize nothing: they match no "
+                    "transaction or are shadowed by an earlier rule."
+                )
@@ -1,12 +1,24 @@
 import streamlit as st
 import sqlite3
-import shutil
 import os
 import uuid
 from datetime import datetime
-from src.database import get_session, engine
+from src.database import (
+    DB_PROFILES,
+    checkpoint,
+    get_db_profile,
+    get_engine,
+    get_session,
+    reset_engine,
+    restore_database,
+)
+from src.dates import EPOCH, to_date
+from src.migrations import upgrade
+from src.money import from_minor
+from src.summary import rebuild_monthly_summary
+from src.config import save_settings
 from src.models import Transaction, Category, Budget, Account, CategoryRule, Note
-from sqlmodel import select
+from sqlmodel import create_engine, select
 
 st.set_page_config(page_title="Settings", page_icon="⚙️")
 
@@ -19,6 +31,7 @@ st.header("1. Backup Data")
 st.markdown("Download your database to share it with another device or keep a backup.")
 
 if os.path.exists(DB_PATH):
+    checkpoint()
     with open(DB_PATH, "rb") as f:
         st.download_button(
             label="📥 Download Database (finance.db)",
@@ -50,8 +63,12 @@ if uploaded_db:
         f.write(uploaded_db.getbuffer())
 
     if st.button("🚀 Start Merge", type="primary"):
+        session = get_session()
         try:
-            session = get_session()
+            # Bring the uploaded file to the current schema before reading it
+            temp_engine = create_engine(f"sqlite:///{temp_path}")
+            upgrade(temp_engine)
+            temp_engine.dispose()
 
             # Connect to Uploaded DB
             con_new = sqlite3.connect(temp_path)
@@ -81,12 +98,14 @@ if uploaded_db:
                 if name in acct_map_name_obj:
                     # Always update balance to match source file
                     target_acct = acct_map_name_obj[name]
-                    target_acct.initial_balance = r_dict.get("initial_balance", 0.0)
+                    target_acct.initial_balance = from_minor(
+                        r_dict.get("initial_balance") or 0
+                    )
                     session.add(target_acct)
                 else:
                     new_acct = Account(
                         name=name,
-                        initial_balance=r_dict.get("initial_balance", 0.0),
+                        initial_balance=from_minor(r_dict.get("initial_balance") or 0),
                         import_config=r_dict.get("import_config"),
                     )
                     session.add(new_acct)
@@ -198,9 +217,13 @@ if uploaded_db:
                 new_acct_id = acct_name_to_new_id.get(old_acct_name, 1)
 
                 if new_cat_id:
+                    # Older backups may still hold free-form date strings
+                    tx_date = to_date(r_dict["date"]) or EPOCH
+                    # Raw rows of the upgraded file hold minor units
+                    tx_amount = from_minor(r_dict["amount"])
                     sig = (
-                        r_dict["date"],
-                        r_dict["amount"],
+                        tx_date,
+                        tx_amount,
                         r_dict["description"],
                         new_cat_id,
                     )
@@ -213,8 +236,8 @@ if uploaded_db:
                             u_hash = uuid.uuid4().hex
 
                         new_t = Transaction(
-                            date=r_dict["date"],
-                            amount=r_dict["amount"],
+                            date=tx_date,
+                            amount=tx_amount,
                             category_id=new_cat_id,
                             description=r_dict["description"],
                             account_id=new_acct_id,
@@ -246,7 +269,7 @@ if uploaded_db:
                     new_cat_id = cat_name_to_new_id.get(cat_name)
 
                     if new_cat_id:
-                        new_amount = r_dict["amount"]
+                        new_amount = from_minor(r_dict["amount"])
 
                         if new_cat_id in budget_map:
                             # Update existing budget if different
@@ -312,6 +335,8 @@ if uploaded_db:
             st.error(f"Error during merge: {e}")
             if os.path.exists(temp_path):
                 os.remove(temp_path)
+        finally:
+            session.close()
 
 st.divider()
 
@@ -331,19 +356,52 @@ restore_db = st.file_uploader(
 if restore_db:
     if st.button("🚨 Overwrite Current Database", type="primary"):
         try:
-            # 1. Dispose engine to release file locks
-            engine.dispose()
-
-            # 2. Backup current DB just in case (renaming it)
-            if os.path.exists(DB_PATH):
-                shutil.copy(DB_PATH, f"{DB_PATH}.bak")
-
-            # 3. Overwrite the file
-            with open(DB_PATH, "wb") as f:
-                f.write(restore_db.getbuffer())
+            restore_database(restore_db.getbuffer())
 
             st.success("Database restored successfully! Reloading app...")
             st.rerun()
 
         except Exception as e:
             st.error(f"Failed to restore database: {e}")
+
+st.divider()
+
+# --- SECTION 4: PERFORMANCE ---
+st.header("4. Database Performance")
+st.markdown(
+    """
+- **durable**: every save is flushed to disk immediately. Safest choice.
+- **fast**: larger cache and memory-mapped reads; saves are flushed in batches.
+  Much quicker imports and bulk edits, but a crash can lose the last few saves.
+"""
+)
+
+profile_names = list(DB_PROFILES.keys())
+current_profile = get_db_profile()
+chosen_profile = st.selectbox(
+    "SQLite profile",
+    profile_names,
+    index=profile_names.index(current_profile),
+    help="Can also be set with the FINANCE_DB_PROFILE environment variable.",
+)
+
+if chosen_profile != current_profile and st.button("Apply Profile"):
+    save_settings(db_profile=chosen_profile)
+    # New connections pick up the profile
+    reset_engine()
+    st.success(f"Switched to the '{chosen_profile}' profile.")
+    st.rerun()
+
+st.divider()
+
+# --- SECTION 5: MAINTENANCE ---
+st.header("5. Maintenance")
+st.markdown(
+    "Dashboard totals are kept in a summary table that updates itself on every "
+    "change. Rebuild it from the transactions if the numbers ever look off."
+)
+
+if st.button("🔁 Rebuild Monthly Summaries"):
+    with get_engine().begin() as conn:
+        rebuild_monthly_summary(conn)
+    st.success("Monthly summaries rebuilt from the transaction history.")
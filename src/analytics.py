@@ -1,6 +1,8 @@
 import plotly.graph_objects as go
 import pandas as pd
 
+from src.cache import cached
+
 
 def create_sankey(df_merged):
     # df_merged expected cols: 'amount', 'group', 'category_name', 'type'
@@ -50,6 +52,7 @@ def create_sankey(df_merged):
     return fig
 
 
+@cached(maxsize=64)
 def create_bullet_chart(category, actual, budget):
     # Avoid division by zero or weird ranges
     max_range = max(budget * 1.2, actual * 1.1) if (budget > 0 or actual > 0) else 100
@@ -0,0 +1,154 @@
+import time
+from decimal import Decimal
+
+from sqlmodel import func, select, text
+
+from src.cache import cached
+from src.dates import month_key
+from src.models import Account, AccountBalance, MonthlySummary, Transaction
+
+# How often `verify_balances` recomputes the cache from scratch (seconds)
+VERIFY_INTERVAL = 24 * 60 * 60
+
+_last_verified = {"at": 0.0}
+
+# Only real (non-virtual) rows move a bank balance. Rows without an
+# account have nothing to update and are ignored.
+_ADD_NEW = """
+    INSERT INTO account_balance (account_id, movement, tx_count)
+    SELECT NEW.account_id, NEW.amount, 1
+    WHERE NEW.account_id IS NOT NULL AND NOT NEW.is_virtual
+    ON CONFLICT (account_id) DO UPDATE SET
+        movement = movement + excluded.movement,
+        tx_count = tx_count + 1;
+"""
+
+_REMOVE_OLD = """
+    UPDATE account_balance SET
+        movement = movement - OLD.amount,
+        tx_count = tx_count - 1
+    WHERE account_id = OLD.account_id AND NOT OLD.is_virtual;
+"""
+
+TRIGGERS = {
+    "trg_balance_insert": f"""
+        CREATE TRIGGER IF NOT EXISTS trg_balance_insert
+        AFTER INSERT ON "transaction"
+        BEGIN {_ADD_NEW} END
+    """,
+    "trg_balance_delete": f"""
+        CREATE TRIGGER IF NOT EXISTS trg_balance_delete
+        AFTER DELETE ON "transaction"
+        BEGIN {_REMOVE_OLD} END
+    """,
+    "trg_balance_update": f"""
+        CREATE TRIGGER IF NOT EXISTS trg_balance_update
+        AFTER UPDATE OF amount, account_id, is_virtual ON "transaction"
+        BEGIN {_REMOVE_OLD} {_ADD_NEW} END
+    """,
+}
+
+_RECOMPUTE = """
+    SELECT account_id, SUM(amount), COUNT(*)
+    FROM "transaction"
+    WHERE account_id IS NOT NULL AND NOT is_virtual
+    GROUP BY account_id
+"""
+
+
+def install_triggers(conn):
+    for ddl in TRIGGERS.values():
+        conn.execute(text(ddl))
+
+
+def rebuild_account_balances(conn):
+    """Recomputes the whole cache from "transaction"."""
+    conn.execute(text("DELETE FROM account_balance"))
+    conn.execute(
+        text(
+            "INSERT INTO account_balance (account_id, movement, tx_count) " + _RECOMPUTE
+        )
+    )
+
+
+def verify_balances(session, force=False):
+    """
+    Compares the cached movements with a full recompute at most once per
+    VERIFY_INTERVAL (or always with `force`) and rebuilds the cache if
+    they disagree. Returns False only when a mismatch was repaired.
+    """
+    now = time.time()
+    if not force and now - _last_verified["at"] < VERIFY_INTERVAL:
+        return True
+    _last_verified["at"] = now
+
+    conn = session.connection()
+    cached = {
+        (r[0], r[1], r[2])
+        for r in conn.execute(
+            text(
+                "SELECT account_id, movement, tx_count FROM account_balance "
+                "WHERE tx_count != 0 OR movement != 0"
+            )
+        )
+    }
+    actual = {(r[0], r[1], r[2]) for r in conn.execute(text(_RECOMPUTE))}
+    if cached == actual:
+        return True
+    rebuild_account_balances(conn)
+    session.commit()
+    return False
+
+
+@cached()
+def get_balances(session):
+    """Current balance per account id: starting balance plus cached movement."""
+    rows = session.exec(
+        select(Account.id, Account.initial_balance, AccountBalance.movement).outerjoin(
+            AccountBalance, AccountBalance.account_id == Account.id
+        )
+    ).all()
+    return {
+        acc_id: initial + (movement or Decimal(0)) for acc_id, initial, movement in rows
+    }
+
+
+@cached()
+def balance_as_of(session, day):
+    """
+    Balance per account id at the end of `day`: whole months come from
+    the monthly summary (a prefix sum over months), and only the rows of
+    the month containing `day` are read from "transaction".
+    """
+    before_month = dict(
+        session.exec(
+            select(
+                MonthlySummary.account_id,
+                func.sum(MonthlySummary.income + MonthlySummary.spend),
+            )
+            .where(
+                MonthlySummary.is_virtual == False,
+                MonthlySummary.month < month_key(day.year, day.month),
+            )
+            .group_by(MonthlySummary.account_id)
+        ).all()
+    )
+    in_month = dict(
+        session.exec(
+            select(Transaction.account_id, func.sum(Transaction.amount))
+            .where(
+                Transaction.is_virtual == False,
+                Transaction.date >= day.replace(day=1),
+                Transaction.date <= day,
+            )
+            .group_by(Transaction.account_id)
+        ).all()
+    )
+    return {
+        acc_id: initial
+        + (before_month.get(acc_id) or Decimal(0))
+        + (in_month.get(acc_id) or Decimal(0))
+        for acc_id, initial in session.exec(
+            select(Account.id, Account.initial_balance)
+        ).all()
+    }
@@ -0,0 +1,133 @@
+import functools
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+from sqlalchemy import event
+from sqlmodel import Session
+
+# Read results are cached under a process-wide "data version" that every
+# commit writing one of these tables bumps, so a cached value stays valid
+# exactly until the data behind it changes. Notes are not watched.
+WATCHED_TABLES = {
+    "transaction",
+    "category",
+    "categoryrule",
+    "budget",
+    "account",
+    "monthly_summary",
+    "account_balance",
+    "transfer_link",
+    "watermark",
+    "merchant",
+}
+
+WRITE_KEYWORDS = ("INSERT", "UPDATE", "DELETE", "REPLACE", "CREATE", "DROP", "ALTER")
+
+DEFAULT_MAXSIZE = 32
+
+_version = {"value": 0}
+_version_lock = threading.Lock()
+
+
+# --- DATA VERSION ---
+def data_version():
+    return _version["value"]
+
+
+def bump_data_version():
+    with _version_lock:
+        _version["value"] += 1
+
+
+def _note_write(conn, cursor, statement, parameters, context, executemany):
+    if context.isinsert or context.isupdate or context.isdelete:
+        table = getattr(context.compiled.statement, "table", None)
+        changed = table is not None and table.name in WATCHED_TABLES
+    else:
+        # DDL and raw SQL (migrations, rebuilds): any write counts
+        changed = statement.lstrip().upper().startswith(WRITE_KEYWORDS)
+    if changed:
+        conn.info["data_changed"] = True
+
+
+def _on_commit(conn):
+    # The "commit" event fires before the DBAPI commit: bumping here would
+    # let another thread read the old rows and cache them under the new
+    # version. The bump waits for the connection to go back to the pool.
+    if conn.info.pop("data_changed", False):
+        conn.info["commit_pending"] = True
+
+
+def _on_rollback(conn):
+    conn.info.pop("data_changed", None)
+
+
+def _on_checkin(dbapi_connection, connection_record):
+    if connection_record.info.pop("commit_pending", False):
+        bump_data_version()
+
+
+def watch_engine(engine):
+    """
+    Bumps the data version whenever a transaction on `engine` commits a
+    write, once the commit is done and the connection is returned to the
+    pool (which sessions and `engine.begin()` blocks do right after it).
+    """
+    event.listen(engine, "before_cursor_execute", _note_write)
+    event.listen(engine, "commit", _on_commit)
+    event.listen(engine, "rollback", _on_rollback)
+    event.listen(engine, "checkin", _on_checkin)
+
+
+# --- CACHE ---
+def _key_part(value):
+    if isinstance(value, (list, set)):
+        return tuple(sorted(value))
+    return value
+
+
+def cached(maxsize=DEFAULT_MAXSIZE):
+    """
+    LRU cache for read-only computations, keyed on the data version and the
+    call arguments. Session arguments are left out of the key. DataFrames
+    are handed out as shallow copies so callers can add columns freely.
+    Safe to share between the threads Streamlit runs sessions on; the
+    computation itself runs outside the lock.
+    """
+
+    def decorator(fn):
+        store = OrderedDict()
+        lock = threading.Lock()
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            key = (
+                data_version(),
+                tuple(_key_part(a) for a in args if not isinstance(a, Session)),
+                tuple(sorted((k, _key_part(v)) for k, v in kwargs.items())),
+            )
+            with lock:
+                hit = key in store
+                if hit:
+                    store.move_to_end(key)
+                    value = store[key]
+            if not hit:
+                value = fn(*args, **kwargs)
+                with lock:
+                    store[key] = value
+                    store.move_to_end(key)
+                    if len(store) > maxsize:
+                        store.popitem(last=False)
+            if isinstance(value, pd.DataFrame):
+                return value.copy(deep=False)
+            return value
+
+        def cache_clear():
+            with lock:
+                store.clear()
+
+        wrapper.cache_clear = cache_clear
+        return wrapper
+
+    return decorator
@@ -0,0 +1,216 @@
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+
+from src import queries
+from src.cache import cached
+
+# Multinomial naive Bayes over hashed character n-grams of the description,
+# trained on the transactions that already have a category. It runs after
+# the keyword rules on import and only fills in rows no rule matched, and
+# only when it is confident. Everything is plain NumPy: a description
+# becomes a sparse row of n-gram counts, and a batch is scored with one
+# gather and a segmented sum (a sparse matrix product with the weights).
+
+MODEL_FILE = "data/classifier.npz"
+
+NGRAMS = (3, 4, 5)
+HASH_BITS = 15  # 32768 features
+MAX_CHARS = 64  # longer descriptions are cut; the tail is mostly codes
+ALPHA = 0.1  # additive smoothing of the n-gram counts
+# Descriptions featurized per step while training, to bound memory
+TRAIN_BATCH = 5000
+# A model needs this many categorized transactions and two categories
+MIN_EXAMPLES = 20
+
+# Posterior probability a guess needs to be used
+MIN_CONFIDENCE = 0.9
+
+# Bumped when features or the file layout change, so old files are retrained
+MODEL_VERSION = 1
+
+_MIX = np.uint64(0x9E3779B97F4A7C15)
+_PRIME = np.uint64(1099511628211)
+
+
+# --- FEATURES ---
+def _normalize(descriptions):
+    # Digits become "0": amounts, dates and references should not count
+    # as different words for every value.
+    return (
+        " "
+        + pd.Series(descriptions, dtype=object)
+        .fillna("")
+        .astype(str)
+        .str.lower()
+        .str.replace(r"\d", "0", regex=True)
+        .str.split()
+        .str.join(" ")
+        + " "
+    )
+
+
+def ngram_features(descriptions):
+    """
+    Hashed character n-grams of each description, as (rows, features):
+    two parallel arrays listing the feature index of every n-gram, sorted
+    by row. Descriptions are encoded into one padded byte matrix and every
+    n-gram position is hashed at once.
+    """
+    encoded = [t.encode("utf-8")[:MAX_CHARS] for t in _normalize(descriptions)]
+    if not encoded:
+        return np.zeros(0, np.int64), np.zeros(0, np.int64)
+    lengths = np.fromiter(map(len, encoded), np.int64, len(encoded))
+    width = max(int(lengths.max()), max(NGRAMS))
+    chars = (
+        np.array(encoded, dtype=f"S{width}")
+        .view(np.uint8)
+        .reshape(len(encoded), width)
+        .astype(np.uint64)
+    )
+
+    hashes, valid = [], []
+    for n in NGRAMS:
+        positions = width - n + 1
+        h = np.full((len(encoded), positions), n, np.uint64)
+        for k in range(n):
+            h = h * _PRIME + chars[:, k : k + positions]
+        hashes.append((h * _MIX) >> np.uint64(64 - HASH_BITS))
+        valid.append(np.arange(positions) + n <= lengths[:, None])
+    hashes, valid = np.hstack(hashes), np.hstack(valid)
+    rows, cols = np.nonzero(valid)
+    return rows, hashes[rows, cols].astype(np.int64)
+
+
+# --- MODEL ---
+class NaiveBayes:
+    def __init__(self, category_ids, log_prior, weights, fingerprint=""):
+        self.category_ids = np.asarray(category_ids, np.int64)
+        self.log_prior = np.asarray(log_prior, np.float32)
+        # log P(n-gram | category), features x categories
+        self.weights = np.asarray(weights, np.float32)
+        self.fingerprint = fingerprint
+
+    @classmethod
+    def train(cls, descriptions, category_ids, counts=None, fingerprint=""):
+        """Fits the model; `counts` weighs each description (e.g. duplicates)."""
+        descriptions = pd.Series(descriptions, dtype=object).reset_index(drop=True)
+        classes, labels = np.unique(np.asarray(category_ids), return_inverse=True)
+        counts = (
+            np.ones(len(labels)) if counts is None else np.asarray(counts, np.float64)
+        )
+        n_features = 1 << HASH_BITS
+        grams = np.zeros(len(classes) * n_features)
+        for start in range(0, len(descriptions), TRAIN_BATCH):
+            rows, features = ngram_features(descriptions[start : start + TRAIN_BATCH])
+            rows += start
+            grams += np.bincount(
+                labels[rows] * n_features + features,
+                weights=counts[rows],
+                minlength=len(grams),
+            )
+        grams = grams.reshape(len(classes), n_features) + ALPHA
+        weights = np.log(grams) - np.log(grams.sum(axis=1, keepdims=True))
+        priors = np.bincount(labels, weights=counts, minlength=len(classes))
+        log_prior = np.log(priors) - np.log(priors.sum())
+        return cls(classes, log_prior, weights.T, fingerprint)
+
+    def predict_proba(self, descriptions):
+        """Posterior probability of each category, one row per description."""
+        descriptions = pd.Series(descriptions, dtype=object)
+        rows, features = ngram_features(descriptions)
+        scores = np.tile(self.log_prior, (len(descriptions), 1))
+        if len(rows):
+            starts = np.flatnonzero(np.r_[True, rows[1:] != rows[:-1]])
+            scores[rows[starts]] += np.add.reduceat(self.weights[features], starts)
+        scores -= scores.max(axis=1, keepdims=True)
+        proba = np.exp(scores)
+        return proba / proba.sum(axis=1, keepdims=True)
+
+    def categorize(self, descriptions, min_confidence=MIN_CONFIDENCE):
+        """
+        Most likely category per row of `descriptions`, or <NA> where its
+        probability is below `min_confidence`. Each distinct text is
+        scored once, the whole batch together.
+        """
+        unique = pd.unique(descriptions)
+        if not len(unique):
+            return pd.Series(pd.NA, index=descriptions.index, dtype="Int64")
+        proba = self.predict_proba(unique)
+        best = proba.argmax(axis=1)
+        guesses = pd.Series(self.category_ids[best], dtype="Int64")
+        guesses[proba[np.arange(len(unique)), best] < min_confidence] = pd.NA
+        return descriptions.map(dict(zip(unique, guesses))).astype("Int64")
+
+    # --- PERSISTENCE ---
+    def save(self, path=MODEL_FILE):
+        # Written aside and renamed, so a reader never sees half a file
+        tmp = f"{path}.tmp.npz"
+        np.savez(
+            tmp,
+            category_ids=self.category_ids,
+            log_prior=self.log_prior,
+            weights=self.weights,
+            fingerprint=np.array(self.fingerprint),
+        )
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path=MODEL_FILE):
+        with np.load(path) as f:
+            return cls(
+                f["category_ids"],
+                f["log_prior"],
+                f["weights"],
+                str(f["fingerprint"]),
+            )
+
+
+# --- TRAINING DATA ---
+def training_data(session, exclude_ids=()):
+    """(description, category_id, count) of the categorized transactions."""
+    df = queries.description_categories(session)
+    df = df[df["category_id"].notna() & ~df["category_id"].isin(exclude_ids)]
+    df = df.astype({"category_id": "int64"})
+    return df.sort_values(["description", "category_id"]).reset_index(drop=True)
+
+
+def fingerprint(data):
+    """Digest of the training set and model settings; equal means same model."""
+    digest = hashlib.sha1(
+        repr((MODEL_VERSION, NGRAMS, HASH_BITS, MAX_CHARS, ALPHA)).encode()
+    )
+    digest.update(pd.util.hash_pandas_object(data, index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+@cached(maxsize=2)
+def get_classifier(session, exclude_ids=()):
+    """
+    The model for the current categorized history, or None when there is
+    too little of it. `exclude_ids` are categories never to be guessed,
+    e.g. Uncategorized. Kept in memory until the next write and on disk
+    in MODEL_FILE, which is reused while its fingerprint still matches
+    the data, so a restart does not retrain.
+    """
+    data = training_data(session, exclude_ids)
+    if data["count"].sum() < MIN_EXAMPLES or data["category_id"].nunique() < 2:
+        return None
+    key = fingerprint(data)
+    if os.path.exists(MODEL_FILE):
+        try:
+            model = NaiveBayes.load(MODEL_FILE)
+            if model.fingerprint == key:
+                return model
+        except (OSError, ValueError, KeyError):
+            pass  # Unreadable: retrain and overwrite
+    model = NaiveBayes.train(
+        data["description"], data["category_id"], data["count"], key
+    )
+    try:
+        model.save(MODEL_FILE)
+    except OSError:
+        pass  # Read-only storage: the in-memory model still works
+    return model
@@ -0,0 +1,43 @@
+import json
+import os
+
+SETTINGS_FILE = "data/settings.json"
+
+DEFAULTS = {
+    "db_profile": "durable",
+    # Decides how many decimals amounts are stored with; see src/money.py
+    "currency": "EUR",
+}
+
+# Environment variables win over the settings file
+ENV_OVERRIDES = {
+    "db_profile": "FINANCE_DB_PROFILE",
+}
+
+
+def load_settings():
+    settings = dict(DEFAULTS)
+    if os.path.exists(SETTINGS_FILE):
+        try:
+            with open(SETTINGS_FILE) as f:
+                settings.update(json.load(f))
+        except (OSError, ValueError):
+            pass
+    for key, env_var in ENV_OVERRIDES.items():
+        if os.environ.get(env_var):
+            settings[key] = os.environ[env_var]
+    return settings
+
+
+def save_settings(**updates):
+    stored = {}
+    if os.path.exists(SETTINGS_FILE):
+        try:
+            with open(SETTINGS_FILE) as f:
+                stored = json.load(f)
+        except (OSError, ValueError):
+            pass
+    stored.update(updates)
+    os.makedirs(os.path.dirname(SETTINGS_FILE), exist_ok=True)
+    with open(SETTINGS_FILE, "w") as f:
+        json.dump(stored, f, indent=2)
@@ -1,6 +1,14 @@
-from sqlmodel import SQLModel, create_engine, Session, select, text
+import streamlit as st
+from sqlalchemy import event
+from sqlmodel import create_engine, Session, select
+from src.cache import bump_data_version, watch_engine
+from src.merchants import backfill_merchants, track_new_transactions
+from src.config import load_settings
 from src.models import Category, Account, Note
+from src.money import CurrencyMismatch
+from src.migrations import upgrade
 import os
+import shutil
 
 # Create data directory if not exists
 if not os.path.exists("data"):
@@ -9,17 +17,123 @@ if not os.path.exists("data"):
 sqlite_file_name = "data/finance.db"
 sqlite_url = f"sqlite:///{sqlite_file_name}"
 
-# check_same_thread=False is needed for Streamlit
-engine = create_engine(sqlite_url, connect_args={"check_same_thread": False})
+# --- SQLITE PROFILES ---
+# Applied to every new connection. Both keep WAL so readers never block the
+# writer; "durable" syncs on every commit, "fast" only at checkpoints (a
+# power cut can lose the last commits, never corrupt the file) and trades
+# memory for speed. PRAGMAs an engine build does not support (e.g. WAL or
+# mmap in the browser) are ignored by SQLite.
+DB_PROFILES = {
+    "durable": {
+        "journal_mode": "WAL",
+        "synchronous": "FULL",
+        "cache_size": -8000,  # KiB
+        "mmap_size": 0,
+        "temp_store": "DEFAULT",
+        "foreign_keys": "ON",
+    },
+    "fast": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -64000,  # KiB
+        "mmap_size": 268435456,
+        "temp_store": "MEMORY",
+        "foreign_keys": "ON",
+    },
+}
+
+
+def get_db_profile():
+    name = load_settings().get("db_profile")
+    return name if name in DB_PROFILES else "durable"
+
+
+def apply_db_profile(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for pragma, value in DB_PROFILES[get_db_profile()].items():
+        cursor.execute(f"PRAGMA {pragma} = {value}")
+    cursor.close()
+
+
+# --- ENGINE & SESSIONS ---
+@st.cache_resource
+def get_engine(db_url=sqlite_url):
+    """
+    One engine per database for the whole process, shared by every rerun
+    and page. Creating it also migrates and seeds the database, so that
+    work happens once per file instead of on every rerun.
+    """
+    # check_same_thread=False is needed for Streamlit
+    engine = create_engine(db_url, connect_args={"check_same_thread": False})
+    event.listen(engine, "connect", apply_db_profile)
+    watch_engine(engine)
+    track_new_transactions()
+    bootstrap(engine)
+    return engine
+
+
+def reset_engine():
+    """Closes all connections and forgets the engine, e.g. before a restore."""
+    get_engine().dispose()
+    get_engine.clear()
+
+
+def restore_database(data):
+    """
+    Replaces finance.db with the bytes of a backup, keeping the current
+    file as finance.db.bak. The app reopens (and migrates) it on the next
+    run.
+    """
+    # Flush the WAL, then dispose the engine to release file locks
+    checkpoint()
+    reset_engine()
+    if os.path.exists(sqlite_file_name):
+        shutil.copy(sqlite_file_name, f"{sqlite_file_name}.bak")
+    with open(sqlite_file_name, "wb") as f:
+        f.write(data)
+    # The old write-ahead log belongs to the replaced file
+    for suffix in ("-wal", "-shm"):
+        if os.path.exists(sqlite_file_name + suffix):
+            os.remove(sqlite_file_name + suffix)
+    # Only now: a read before this point still sees the old file, and
+    # nothing commits to tell the cache the data changed
+    bump_data_version()
 
 
 def get_session():
-    return Session(engine)
+    """
+    New Session on the shared engine. Use it as a context manager so it is
+    closed (and its connection returned to the pool) when the page run
+    ends, including runs cut short by st.stop() or st.rerun():
+
+        with get_session() as session:
+            ...
+    """
+    return Session(get_engine())
+
+
+def checkpoint():
+    """Folds the WAL back into finance.db so the file alone is a full copy."""
+    with get_engine().connect() as conn:
+        conn.exec_driver_sql("PRAGMA wal_checkpoint(TRUNCATE)")
 
 
 def init_db():
+    get_engine()
 
-    SQLModel.metadata.create_all(engine)
+
+def bootstrap(engine):
+
+    try:
+        upgrade(engine)
+    except CurrencyMismatch as e:
+        st.error(str(e))
+        st.stop()
+
+    # Rows written outside the app (or restored from a backup) have no
+    # merchant yet; a no-op once every row has one
+    with engine.begin() as conn:
+        backfill_merchants(conn)
 
     with Session(engine) as session:
 
@@ -48,3 +162,4 @@ def init_db():
         first_note = session.exec(select(Note)).first()
         if not first_note:
             session.add(Note(content="My Finance Notes..."))
+            session.commit()
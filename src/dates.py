@@ -0,0 +1,41 @@
+import re
+from datetime import date, timedelta
+
+import pandas as pd
+
+EPOCH = date(1970, 1, 1)
+
+
+def month_range(year, month):
+    """Half-open [start, end) bounds of a calendar month."""
+    start = date(year, month, 1)
+    end = date(year + 1, 1, 1) if month == 12 else date(year, month + 1, 1)
+    return start, end
+
+
+def month_key(year, month):
+    """ "YYYY-MM" label used by the monthly_summary table."""
+    return f"{int(year):04d}-{int(month):02d}"
+
+
+def day_range(start, end=None):
+    """Half-open bounds covering the days from `start` to `end` inclusive."""
+    return start, (end or start) + timedelta(days=1)
+
+
+def to_date(value):
+    """
+    Best-effort parse of a date stored by older versions of the app,
+    which kept whatever string the importer could not understand.
+    Year-first values are read as ISO, everything else day first.
+    Returns None if the value is not a date at all.
+    """
+    if isinstance(value, date):
+        return value
+    s_val = str(value).strip()
+    try:
+        if re.match(r"^\d{4}", s_val):
+            return pd.to_datetime(s_val, yearfirst=True).date()
+        return pd.to_datetime(s_val, dayfirst=True).date()
+    except (ValueError, OverflowError):
+        return None
@@ -0,0 +1,419 @@
+import hashlib
+from typing import NamedTuple
+
+import pandas as pd
+from sqlmodel import insert, select
+
+from src.classifier import MIN_CONFIDENCE
+from src.merchants import merchant_ids
+from src.models import Transaction
+from src.money import EXPONENT, from_minor, minor_series, to_minor
+from src.mutations import chunked
+
+# Statement rows parsed and written per step of a streaming import
+DEFAULT_CHUNK_SIZE = 5000
+
+# Rows with unparseable dates kept for display after an import
+MAX_REJECTED_ROWS = 500
+
+DATE_FORMATS = [
+    "Auto",
+    "Day-Month-Year (DD/MM/YYYY)",
+    "Month-Day-Year (MM/DD/YYYY)",
+    "Year-Month-Day (YYYY-MM-DD)",
+]
+
+
+# --- HASHING ---
+def generate_hash(date, desc, amount):
+    # Hash the exact amount in minor units, not a float repr
+    raw = f"{date}{desc}{to_minor(amount, EXPONENT)}"
+    return hashlib.md5(raw.encode()).hexdigest()
+
+
+def generate_hashes(dates, descriptions, amounts):
+    """Column version of `generate_hash` (same digest for the same row)."""
+    minor = minor_series(amounts, EXPONENT)
+    raw = dates.astype(str) + descriptions.astype(str) + minor.astype(str)
+    return pd.Series(
+        [hashlib.md5(r.encode()).hexdigest() for r in raw], index=raw.index
+    )
+
+
+# --- HEADER DETECTION ---
+def find_header_row(df):
+    keywords = [
+        "date",
+        "data",
+        "description",
+        "descrizione",
+        "amount",
+        "importo",
+        "addebiti",
+        "accrediti",
+    ]
+    for idx, row in df.head(20).iterrows():
+        row_str = " ".join(row.astype(str)).lower()
+        matches = sum(1 for k in keywords if k in row_str)
+        if matches >= 2:
+            return idx
+    return 0
+
+
+# --- READING ---
+def is_csv(uploaded_file):
+    return uploaded_file.name.endswith(".csv")
+
+
+def detect_header(uploaded_file):
+    if is_csv(uploaded_file):
+        preview = pd.read_csv(uploaded_file, header=None, nrows=20)
+    else:
+        preview = pd.read_excel(uploaded_file, header=None, nrows=20)
+    uploaded_file.seek(0)
+    return find_header_row(preview)
+
+
+def read_head(uploaded_file, header_idx, nrows=200):
+    if is_csv(uploaded_file):
+        df = pd.read_csv(uploaded_file, header=header_idx, nrows=nrows)
+    else:
+        df = pd.read_excel(uploaded_file, header=header_idx, nrows=nrows)
+    uploaded_file.seek(0)
+    return df
+
+
+def iter_chunks(uploaded_file, header_idx, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Yields the statement as DataFrames of at most `chunk_size` rows.
+    CSV files are streamed from disk; Excel has no incremental reader in
+    pandas, so the sheet is loaded once and handed out in slices.
+    """
+    if is_csv(uploaded_file):
+        with pd.read_csv(
+            uploaded_file, header=header_idx, chunksize=chunk_size
+        ) as reader:
+            yield from reader
+    else:
+        df = pd.read_excel(uploaded_file, header=header_idx)
+        for start in range(0, len(df), chunk_size):
+            yield df.iloc[start : start + chunk_size]
+
+
+# --- COLUMN PARSERS ---
+YEAR_FIRST_FORMATS = [
+    "%Y-%m-%d",
+    "%Y/%m/%d",
+    "%Y.%m.%d",
+    "%Y%m%d",
+    "%Y-%m-%d %H:%M:%S",
+    "%Y-%m-%dT%H:%M:%S",
+    "%Y-%m-%d %H:%M",
+]
+DAY_FIRST_FORMATS = [
+    "%d/%m/%Y",
+    "%d-%m-%Y",
+    "%d.%m.%Y",
+    "%d/%m/%y",
+    "%d-%m-%y",
+    "%d.%m.%y",
+    "%d/%m/%Y %H:%M:%S",
+    "%d/%m/%Y %H:%M",
+    "%d.%m.%Y %H:%M:%S",
+    "%d %b %Y",
+    "%d-%b-%Y",
+    "%d %B %Y",
+]
+MONTH_FIRST_FORMATS = [
+    "%m/%d/%Y",
+    "%m-%d-%Y",
+    "%m/%d/%y",
+    "%m/%d/%Y %H:%M:%S",
+    "%m/%d/%Y %H:%M",
+    "%b %d, %Y",
+    "%B %d, %Y",
+]
+
+# Candidate order breaks ties, so ambiguous columns like 01/02/2023 resolve
+# day first in Auto mode, as they always have.
+FORMAT_CANDIDATES = {
+    "Auto": YEAR_FIRST_FORMATS + DAY_FIRST_FORMATS + MONTH_FIRST_FORMATS,
+    "Day-Month-Year (DD/MM/YYYY)": DAY_FIRST_FORMATS,
+    "Month-Day-Year (MM/DD/YYYY)": MONTH_FIRST_FORMATS,
+    "Year-Month-Day (YYYY-MM-DD)": YEAR_FIRST_FORMATS,
+}
+
+
+def _clean_dates(col):
+    return col.where(col.isna(), col.astype(str).str.strip())
+
+
+def infer_date_format(col, fmt_mode="Auto", sample_size=200):
+    """
+    Picks the single strptime format that parses the most values of a
+    sample of `col`. Returns None if no candidate parses anything, or if
+    the column already holds datetimes (e.g. from Excel).
+    """
+    if pd.api.types.is_datetime64_any_dtype(col):
+        return None
+    sample = _clean_dates(col).dropna().head(sample_size)
+    if sample.empty:
+        return None
+
+    best_fmt, best_ok = None, 0
+    for fmt in FORMAT_CANDIDATES.get(fmt_mode, FORMAT_CANDIDATES["Auto"]):
+        ok = pd.to_datetime(sample, format=fmt, errors="coerce").notna().sum()
+        if ok > best_ok:
+            best_fmt, best_ok = fmt, ok
+            if ok == len(sample):
+                break
+    return best_fmt
+
+
+def resolve_date_format(col, fmt_mode, saved_config):
+    """
+    Reuses the format stored with the account when the user kept the same
+    date mode and it parses every value of `col`; otherwise infers a new one.
+    """
+    saved_fmt = saved_config.get("date_strptime")
+    if saved_fmt and saved_config.get("date_fmt") == fmt_mode:
+        sample = _clean_dates(col).dropna()
+        if pd.to_datetime(sample, format=saved_fmt, errors="coerce").notna().all():
+            return saved_fmt
+    return infer_date_format(col, fmt_mode)
+
+
+def parse_dates(col, strptime_fmt):
+    """
+    Converts a whole date column with one explicit format.
+    Values that do not fit the format come back as NaN.
+    """
+    if pd.api.types.is_datetime64_any_dtype(col):
+        parsed = col
+    elif strptime_fmt is None:
+        return pd.Series(float("nan"), index=col.index, dtype=object)
+    else:
+        parsed = pd.to_datetime(_clean_dates(col), format=strptime_fmt, errors="coerce")
+    return parsed.dt.strftime("%Y-%m-%d").where(parsed.notna())
+
+
+def join_descriptions(df, desc_cols):
+    if not desc_cols:
+        return pd.Series("NO DESC", index=df.index)
+
+    result = None
+    for c in desc_cols:
+        part = df[c].astype(str).str.strip().where(df[c].notna())
+        if result is None:
+            result = part
+        else:
+            both = result.notna() & part.notna()
+            result = result.where(result.notna(), part)
+            result[both] = result[both] + " " + part[both]
+    return result.fillna("").astype(str)
+
+
+def normalize_amounts(df, config):
+    if config.get("amount_mode", "Single Column") == "Single Column":
+        raw = (
+            df[config["amt_col"]]
+            .astype(str)
+            .str.replace("€", "", regex=False)
+            .str.replace("$", "", regex=False)
+            .str.replace(",", ".", regex=False)
+            .str.strip()
+        )
+        amounts = pd.to_numeric(raw, errors="coerce")
+        return amounts.where(raw != "", 0.0)
+
+    credit = pd.to_numeric(df[config["credit_col"]], errors="coerce").fillna(0.0)
+    debit = pd.to_numeric(df[config["debit_col"]], errors="coerce").fillna(0.0)
+    return credit - debit
+
+
+def prepare_transactions(df, config):
+    """
+    Turns a raw statement into columns ready to insert:
+    date, description, amount, unique_hash.
+    Rows without a usable amount are dropped. Rows whose date does not fit
+    the column format are returned separately as `rejected`.
+    """
+    out = pd.DataFrame(
+        {
+            "date": parse_dates(df[config["date_col"]], config.get("date_strptime")),
+            "description": join_descriptions(df, config.get("desc_cols")),
+            "amount": normalize_amounts(df, config).astype(float),
+        },
+        index=df.index,
+    )
+    out = out[out["amount"].notna() & (out["amount"] != 0)]
+
+    bad_date = out["date"].isna()
+    rejected = pd.DataFrame(
+        {
+            "row": out.index[bad_date],
+            "raw_date": df.loc[out.index[bad_date], config["date_col"]].values,
+            "description": out.loc[bad_date, "description"].values,
+            "amount": out.loc[bad_date, "amount"].values,
+        }
+    )
+    out = out[~bad_date]
+
+    out["unique_hash"] = generate_hashes(out["date"], out["description"], out["amount"])
+    return out, rejected
+
+
+# --- DEDUPLICATION ---
+def existing_hashes(session, hashes):
+    """Returns the subset of `hashes` already stored, one query per chunk."""
+    found = set()
+    for chunk in chunked(hashes):
+        found.update(
+            session.exec(
+                select(Transaction.unique_hash).where(
+                    Transaction.unique_hash.in_(chunk)
+                )
+            ).all()
+        )
+    return found
+
+
+# --- SAVE ---
+class ImportResult(NamedTuple):
+    inserted: int
+    skipped: int
+    rejected: int = 0
+    guessed: int = 0  # rows categorized by the classifier, not a rule
+
+
+def categorize(
+    descriptions,
+    rule_engine,
+    default_cat_id,
+    classifier=None,
+    min_confidence=MIN_CONFIDENCE,
+):
+    """
+    Category per description: the first matching rule, else the guess of
+    `classifier` (see src/classifier.py) when it is at least
+    `min_confidence` sure, else the default. Also returns how many rows
+    were guessed.
+    """
+    categories = rule_engine.categorize(descriptions)
+    unmatched = categories.isna()
+    guessed = 0
+    if classifier is not None and unmatched.any():
+        guesses = classifier.categorize(descriptions[unmatched], min_confidence)
+        categories = categories.fillna(guesses)
+        guessed = int(guesses.notna().sum())
+    return categories.fillna(default_cat_id), guessed
+
+
+def save_transactions(
+    session,
+    prepared,
+    account_id,
+    rule_engine,
+    default_cat_id,
+    classifier=None,
+    min_confidence=MIN_CONFIDENCE,
+):
+    """
+    Writes new rows of `prepared` with a single bulk INSERT.
+    Rows whose hash is repeated in the file or already stored are skipped.
+    """
+    new_rows = prepared.drop_duplicates("unique_hash")
+    known = existing_hashes(session, new_rows["unique_hash"])
+    new_rows = new_rows[~new_rows["unique_hash"].isin(known)]
+    if new_rows.empty:
+        return ImportResult(0, len(prepared))
+
+    category_id, guessed = categorize(
+        new_rows["description"],
+        rule_engine,
+        default_cat_id,
+        classifier,
+        min_confidence,
+    )
+    new_rows = new_rows.assign(
+        date=pd.to_datetime(new_rows["date"], format="%Y-%m-%d").dt.date,
+        amount=[
+            from_minor(m, EXPONENT) for m in minor_series(new_rows["amount"], EXPONENT)
+        ],
+        category_id=category_id,
+        merchant_id=merchant_ids(
+            session.connection(), new_rows["description"]
+        ).to_numpy(),
+        account_id=account_id,
+        is_virtual=False,
+        is_settled=False,
+    )
+    records = new_rows[
+        [
+            "date",
+            "description",
+            "amount",
+            "category_id",
+            "account_id",
+            "unique_hash",
+            "is_virtual",
+            "is_settled",
+            "merchant_id",
+        ]
+    ].to_dict("records")
+    # OR IGNORE covers rows written by another tab between lookup and insert
+    result = session.connection().execute(
+        insert(Transaction.__table__).prefix_with("OR IGNORE"), records
+    )
+    session.commit()
+    inserted = result.rowcount if result.rowcount >= 0 else len(records)
+    return ImportResult(inserted, len(prepared) - inserted, guessed=guessed)
+
+
+def import_chunks(
+    session,
+    chunks,
+    config,
+    account_id,
+    rule_engine,
+    default_cat_id,
+    on_chunk=None,
+    classifier=None,
+    min_confidence=MIN_CONFIDENCE,
+):
+    """
+    Runs parse -> dedup -> categorize -> insert on each chunk in turn, so
+    only one chunk of the statement is held in memory at a time. With a
+    `classifier`, rows no rule matches get its confident guesses.
+    `on_chunk(rows_read, result_so_far)` is called after every chunk.
+    Returns the totals and up to MAX_REJECTED_ROWS rows with bad dates.
+    """
+    inserted, skipped, rejected, guessed, rows_read = 0, 0, 0, 0, 0
+    rejected_rows = []
+    for chunk in chunks:
+        rows_read += len(chunk)
+        prepared, bad = prepare_transactions(chunk, config)
+        result = save_transactions(
+            session,
+            prepared,
+            account_id,
+            rule_engine,
+            default_cat_id,
+            classifier,
+            min_confidence,
+        )
+        inserted += result.inserted
+        guessed += result.guessed
+        skipped += result.skipped
+        rejected += len(bad)
+        if not bad.empty and sum(map(len, rejected_rows)) < MAX_REJECTED_ROWS:
+            rejected_rows.append(bad)
+        if on_chunk:
+            on_chunk(rows_read, ImportResult(inserted, skipped, rejected, guessed))
+
+    rejected_df = (
+        pd.concat(rejected_rows).head(MAX_REJECTED_ROWS)
+        if rejected_rows
+        else pd.DataFrame(columns=["row", "raw_date", "description", "amount"])
+    )
+    return ImportResult(inserted, skipped, rejected, guessed), rejected_df
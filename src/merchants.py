@@ -0,0 +1,119 @@
+import functools
+
+import pandas as pd
+from sqlalchemy import event, insert
+from sqlmodel import Session, select, text
+
+from src.models import Merchant, Transaction
+from src.mutations import chunked
+
+# Bank descriptions embed card numbers, dates, terminal ids and reference
+# codes, so one shop shows up under many strings. Each description is
+# reduced to a merchant key ("AMAZON MKTPLACE 1234*AB" -> "AMAZON
+# MKTPLACE"), interned once in the merchant table and referenced by
+# Transaction.merchant_id. Grouping by merchant then works on a few
+# hundred keys instead of every distinct description. Category rules
+# keep matching the raw description, since patterns may rely on the
+# parts a key drops.
+
+_EDGE_PUNCTUATION = "*#/\\-_.,:;()[]'\"+"
+
+
+def _is_code(token):
+    """Card numbers, dates, amounts and references: mostly digits."""
+    digits = sum(ch.isdigit() for ch in token)
+    return digits >= 2 or digits * 2 >= len(token)
+
+
+@functools.lru_cache(maxsize=65536)
+def merchant_key(description):
+    """
+    Upper-case words of `description` without the codes around them.
+    Descriptions made only of codes keep their full text.
+    """
+    text = " ".join(str(description).upper().split())
+    words = []
+    for token in text.split(" "):
+        if any(ch.isdigit() for ch in token) and _is_code(token):
+            continue
+        token = token.strip(_EDGE_PUNCTUATION)
+        if token:
+            words.append(token)
+    return " ".join(words) or text
+
+
+def _lookup(conn, keys):
+    found = {}
+    for chunk in chunked(keys):
+        found.update(
+            (key, merchant_id)
+            for merchant_id, key in conn.execute(
+                select(Merchant.id, Merchant.key).where(Merchant.key.in_(chunk))
+            )
+        )
+    return found
+
+
+def merchant_ids(conn, descriptions):
+    """
+    Merchant id for each of `descriptions` (a Series in the same order),
+    adding the merchants not stored yet. Statements are per distinct key,
+    not per row, so a whole import chunk costs a few queries.
+    """
+    keys = pd.Series(descriptions, dtype=object).map(merchant_key)
+    unique = keys.unique().tolist()
+    ids = _lookup(conn, unique)
+    missing = [key for key in unique if key not in ids]
+    if missing:
+        conn.execute(
+            insert(Merchant.__table__).prefix_with("OR IGNORE"),
+            [{"key": key} for key in missing],
+        )
+        ids.update(_lookup(conn, missing))
+    return keys.map(ids)
+
+
+def backfill_merchants(conn):
+    """Gives every transaction without a merchant its merchant."""
+    descriptions = (
+        conn.execute(
+            select(Transaction.description)
+            .where(Transaction.merchant_id == None)
+            .distinct()
+        )
+        .scalars()
+        .all()
+    )
+    if not descriptions:
+        return
+    ids = merchant_ids(conn, descriptions)
+    conn.execute(
+        text(
+            'UPDATE "transaction" SET merchant_id = :merchant_id '
+            "WHERE description = :description AND merchant_id IS NULL"
+        ),
+        [{"merchant_id": int(m), "description": d} for d, m in zip(descriptions, ids)],
+    )
+
+
+# --- ORM WRITES ---
+def _assign_on_flush(session, flush_context, instances):
+    new = [
+        obj
+        for obj in session.new
+        if isinstance(obj, Transaction) and obj.merchant_id is None
+    ]
+    if new:
+        ids = merchant_ids(session.connection(), [tx.description for tx in new])
+        for tx, merchant_id in zip(new, ids):
+            tx.merchant_id = int(merchant_id)
+
+
+def track_new_transactions():
+    """
+    Transactions added through a Session (manual entries, adjustments,
+    merges) get their merchant when flushed. Bulk inserts set it
+    themselves (see src/importer.py).
+    """
+    if not event.contains(Session, "before_flush", _assign_on_flush):
+        event.listen(Session, "before_flush", _assign_on_flush)
@@ -0,0 +1,272 @@
+import hashlib
+
+from sqlalchemy import MetaData, inspect
+from sqlalchemy.schema import CreateTable
+from sqlmodel import SQLModel, text
+
+from src import balances, merchants, money, search, summary
+from src.dates import EPOCH, to_date
+from src.models import (
+    Account,
+    Budget,
+    Merchant,
+    Meta,
+    Transaction,
+    TransferLink,
+    Watermark,
+)
+
+
+# --- HELPERS ---
+def get_version(conn):
+    return conn.execute(text("PRAGMA user_version")).scalar()
+
+
+def set_version(conn, version):
+    # PRAGMA does not accept bound parameters
+    conn.execute(text(f"PRAGMA user_version = {int(version)}"))
+
+
+def add_column(conn, table, column, ddl):
+    """ALTER TABLE ... ADD COLUMN, skipped when the column already exists."""
+    existing = {c["name"] for c in inspect(conn).get_columns(table)}
+    if column not in existing:
+        conn.execute(text(f'ALTER TABLE "{table}" ADD COLUMN {column} {ddl}'))
+
+
+def rebuild_table(conn, table, select_exprs):
+    """
+    SQLite cannot change a column's type in place. Copies `table` into a
+    fresh one created from the current model, with `select_exprs` (column
+    name -> SQL expression over the old table) overriding plain copies.
+    Expects foreign key enforcement to be off (see `upgrade`). Triggers
+    on the old table are dropped with it; `create_triggers` restores them.
+    """
+    existing = {c["name"] for c in inspect(conn).get_columns(table.name)}
+    columns = [c.name for c in table.columns if c.name in existing]
+    exprs = [select_exprs.get(c, f'"{c}"') for c in columns]
+
+    # Resolve foreign keys against a copy of the full schema
+    scratch = MetaData()
+    for t in SQLModel.metadata.sorted_tables:
+        t.to_metadata(scratch)
+    new_name = f"_new_{table.name}"
+    new_table = table.to_metadata(scratch, name=new_name)
+    conn.execute(CreateTable(new_table))
+
+    col_list = ", ".join(f'"{c}"' for c in columns)
+    conn.execute(
+        text(
+            f'INSERT INTO "{new_name}" ({col_list}) '
+            f'SELECT {", ".join(exprs)} FROM "{table.name}"'
+        )
+    )
+    conn.execute(text(f'DROP TABLE "{table.name}"'))
+    conn.execute(text(f'ALTER TABLE "{new_name}" RENAME TO "{table.name}"'))
+    for index in table.indexes:
+        index.create(conn)
+
+
+def create_triggers(conn):
+    """Triggers are not part of the models, so create_all cannot make them."""
+    summary.install_triggers(conn)
+    balances.install_triggers(conn)
+    search.install_triggers(conn)
+
+
+# --- STEPS ---
+def normalize_transaction_dates(conn):
+    """
+    Rewrites legacy free-form dates as ISO YYYY-MM-DD so the column can be
+    range-filtered and read back as a DATE. Values that are not dates at
+    all are moved to 1970-01-01 where they stay visible but out of the way.
+    """
+    rows = conn.execute(
+        text(
+            'SELECT id, date FROM "transaction" '
+            "WHERE date NOT GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]'"
+        )
+    ).all()
+    updates = [
+        {"id": tx_id, "date": (to_date(raw) or EPOCH).isoformat()}
+        for tx_id, raw in rows
+    ]
+    if updates:
+        conn.execute(
+            text('UPDATE "transaction" SET date = :date WHERE id = :id'), updates
+        )
+    conn.execute(
+        text('CREATE INDEX IF NOT EXISTS ix_transaction_date ON "transaction" (date)')
+    )
+
+
+def add_query_indexes(conn):
+    # Same names as the indexes declared on the models, so fresh databases
+    # created by create_all end up identical.
+    statements = [
+        "CREATE INDEX IF NOT EXISTS ix_transaction_account_date "
+        'ON "transaction" (account_id, date)',
+        "CREATE INDEX IF NOT EXISTS ix_transaction_category_date "
+        'ON "transaction" (category_id, date)',
+        "CREATE INDEX IF NOT EXISTS ix_transaction_virtual_settled "
+        'ON "transaction" (is_virtual, is_settled)',
+        "CREATE INDEX IF NOT EXISTS ix_categoryrule_category_id "
+        "ON categoryrule (category_id)",
+    ]
+    for stmt in statements:
+        conn.execute(text(stmt))
+
+
+def amounts_to_minor_units(conn):
+    """
+    Stores every amount as an INTEGER number of minor units (cents).
+    Import hashes were built from the float repr of the amount, so they
+    are rebuilt from the exact value first: otherwise re-importing an old
+    statement would no longer recognise its rows.
+    """
+    rows = conn.execute(
+        text('SELECT id, date, description, amount, unique_hash FROM "transaction"')
+    ).all()
+    taken = {r.unique_hash for r in rows}
+    updates = []
+    for r in rows:
+        legacy = hashlib.md5(f"{r.date}{r.description}{r.amount}".encode())
+        if legacy.hexdigest() != r.unique_hash:
+            continue  # manual or virtual entry with its own id scheme
+        minor = round(r.amount * money.SCALE)
+        new_hash = hashlib.md5(f"{r.date}{r.description}{minor}".encode())
+        new_hash = new_hash.hexdigest()
+        if new_hash not in taken:
+            taken.add(new_hash)
+            updates.append({"id": r.id, "unique_hash": new_hash})
+    if updates:
+        conn.execute(
+            text('UPDATE "transaction" SET unique_hash = :unique_hash WHERE id = :id'),
+            updates,
+        )
+
+    to_int = "CAST(ROUND({col} * %d) AS INTEGER)" % money.SCALE
+    rebuild_table(
+        conn,
+        Account.__table__,
+        {"initial_balance": to_int.format(col="initial_balance")},
+    )
+    rebuild_table(conn, Budget.__table__, {"amount": to_int.format(col="amount")})
+    rebuild_table(conn, Transaction.__table__, {"amount": to_int.format(col="amount")})
+    # The scale used here is the one every later read must use
+    Meta.__table__.create(conn, checkfirst=True)
+    money.record_exponent(conn, money.EXPONENT)
+
+
+def add_monthly_summary(conn):
+    """Backfills the monthly_summary table and starts maintaining it."""
+    create_triggers(conn)
+    summary.rebuild_monthly_summary(conn)
+
+
+def add_account_balances(conn):
+    """Backfills the account_balance cache and starts maintaining it."""
+    create_triggers(conn)
+    balances.rebuild_account_balances(conn)
+
+
+def add_description_search(conn):
+    """Creates the FTS5 index over descriptions (where available) and fills it."""
+    create_triggers(conn)
+    search.rebuild_fts(conn)
+
+
+def add_transfer_links(conn):
+    """
+    Creates the transfer link and watermark tables. Rows already in the
+    Transfer category keep it but have no recorded partner to unlink.
+    """
+    TransferLink.__table__.create(conn, checkfirst=True)
+    Watermark.__table__.create(conn, checkfirst=True)
+
+
+def add_merchants(conn):
+    """
+    Adds the merchant table and Transaction.merchant_id, then interns the
+    merchant of every stored description.
+    """
+    Merchant.__table__.create(conn, checkfirst=True)
+    add_column(conn, "transaction", "merchant_id", "INTEGER REFERENCES merchant (id)")
+    conn.execute(
+        text(
+            "CREATE INDEX IF NOT EXISTS ix_transaction_merchant_id "
+            'ON "transaction" (merchant_id)'
+        )
+    )
+    merchants.backfill_merchants(conn)
+
+
+def record_money_exponent(conn):
+    """
+    Records the amount exponent in databases converted to minor units
+    before it was stored. It is the configured one: reads have used it.
+    """
+    Meta.__table__.create(conn, checkfirst=True)
+    money.record_exponent(conn, money.EXPONENT)
+
+
+# Ordered (version, step). Never renumber or edit a released step; append.
+MIGRATIONS = [
+    (1, normalize_transaction_dates),
+    (2, add_query_indexes),
+    (3, amounts_to_minor_units),
+    (4, add_monthly_summary),
+    (5, add_account_balances),
+    (6, add_description_search),
+    (7, add_transfer_links),
+    (8, add_merchants),
+    (9, record_money_exponent),
+]
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def upgrade(engine):
+    """
+    Brings a finance.db up to the current schema and returns the versions
+    applied. Raises money.CurrencyMismatch, before changing anything, for
+    a database whose amounts use another currency exponent. New databases get every table and index from the models via
+    create_all, plus the triggers, and are stamped with the latest version;
+    existing ones run each pending step in its own transaction.
+    """
+    fresh = not inspect(engine).has_table("transaction")
+    SQLModel.metadata.create_all(engine)
+
+    if fresh:
+        with engine.begin() as conn:
+            create_triggers(conn)
+            money.record_exponent(conn, money.EXPONENT)
+            set_version(conn, LATEST_VERSION)
+        return []
+
+    with engine.connect() as conn:
+        # Before any step: amounts must not be rewritten at the wrong scale
+        money.check_exponent(conn)
+        current = get_version(conn)
+
+    applied = []
+    for version, step in MIGRATIONS:
+        if version <= current:
+            continue
+        with engine.connect() as conn:
+            # Table rebuilds must not trip (or cascade) foreign keys, and the
+            # PRAGMA is a no-op inside a transaction, so it comes first. The
+            # explicit BEGIN makes the driver keep DDL in the transaction.
+            conn.exec_driver_sql("PRAGMA foreign_keys = OFF")
+            conn.exec_driver_sql("BEGIN")
+            step(conn)
+            set_version(conn, version)
+            conn.commit()
+        applied.append(version)
+
+    if applied:
+        # Drop pooled connections so the FK setting comes back, and refresh
+        # planner statistics for the new indexes
+        engine.dispose()
+        with engine.begin() as conn:
+            conn.execute(text("ANALYZE"))
+    return applied
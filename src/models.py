@@ -1,13 +1,16 @@
+from decimal import Decimal
 from typing import Optional
-from datetime import datetime
-from sqlmodel import Field, SQLModel
+from datetime import date as Date, datetime
+from sqlmodel import Field, Index, SQLModel
+
+from src.money import Money
 
 
 class Account(SQLModel, table=True):
     __table_args__ = {"extend_existing": True}
     id: Optional[int] = Field(default=None, primary_key=True)
     name: str = Field(index=True, unique=True)
-    initial_balance: float = Field(default=0.0)
+    initial_balance: Decimal = Field(default=Decimal(0), sa_type=Money)
     import_config: Optional[str] = Field(default=None)
 
 
@@ -24,22 +27,36 @@ class CategoryRule(SQLModel, table=True):
     __table_args__ = {"extend_existing": True}
     id: Optional[int] = Field(default=None, primary_key=True)
     keyword: str
-    category_id: int = Field(foreign_key="category.id")
+    category_id: int = Field(foreign_key="category.id", index=True)
 
 
 class Budget(SQLModel, table=True):
     __table_args__ = {"extend_existing": True}
     id: Optional[int] = Field(default=None, primary_key=True)
     category_id: int = Field(foreign_key="category.id")
-    amount: float
+    amount: Decimal = Field(sa_type=Money)
 
 
-class Transaction(SQLModel, table=True):
+class Merchant(SQLModel, table=True):
+    """A description with its codes stripped, see src/merchants.py."""
+
     __table_args__ = {"extend_existing": True}
     id: Optional[int] = Field(default=None, primary_key=True)
-    date: str
+    key: str = Field(unique=True)
+
+
+class Transaction(SQLModel, table=True):
+    # Composite indexes match the page queries; see src/migrations.py
+    __table_args__ = (
+        Index("ix_transaction_account_date", "account_id", "date"),
+        Index("ix_transaction_category_date", "category_id", "date"),
+        Index("ix_transaction_virtual_settled", "is_virtual", "is_settled"),
+        {"extend_existing": True},
+    )
+    id: Optional[int] = Field(default=None, primary_key=True)
+    date: Date = Field(index=True)
     description: str
-    amount: float
+    amount: Decimal = Field(sa_type=Money)
     category_id: Optional[int] = Field(default=None, foreign_key="category.id")
     account_id: Optional[int] = Field(default=None, foreign_key="account.id")
     unique_hash: str = Field(unique=True)
@@ -47,6 +64,69 @@ class Transaction(SQLModel, table=True):
     is_virtual: bool = Field(default=False)
     is_settled: bool = Field(default=False)
 
+    merchant_id: Optional[int] = Field(
+        default=None, foreign_key="merchant.id", index=True
+    )
+
+
+class MonthlySummary(SQLModel, table=True):
+    """Per-month totals of "transaction", maintained by the triggers in src/summary.py."""
+
+    __tablename__ = "monthly_summary"
+    __table_args__ = {"extend_existing": True}
+    month: str = Field(primary_key=True)  # "YYYY-MM"
+    account_id: int = Field(default=0, primary_key=True)  # 0 = no account
+    category_id: int = Field(default=0, primary_key=True)  # 0 = no category
+    is_virtual: bool = Field(default=False, primary_key=True)
+    income: Decimal = Field(default=Decimal(0), sa_type=Money)
+    spend: Decimal = Field(default=Decimal(0), sa_type=Money)
+    tx_count: int = Field(default=0)
+
+
+class AccountBalance(SQLModel, table=True):
+    """Sum of the real transactions per account, maintained by the triggers in src/balances.py."""
+
+    __tablename__ = "account_balance"
+    __table_args__ = {"extend_existing": True}
+    account_id: int = Field(primary_key=True)
+    movement: Decimal = Field(default=Decimal(0), sa_type=Money)
+    tx_count: int = Field(default=0)
+
+
+class TransferLink(SQLModel, table=True):
+    """An outgoing and an incoming transaction paired as one internal transfer."""
+
+    __tablename__ = "transfer_link"
+    __table_args__ = {"extend_existing": True}
+    id: Optional[int] = Field(default=None, primary_key=True)
+    outgoing_tx_id: int = Field(
+        foreign_key="transaction.id", ondelete="CASCADE", unique=True
+    )
+    incoming_tx_id: int = Field(
+        foreign_key="transaction.id", ondelete="CASCADE", unique=True
+    )
+    delta_days: int = Field(default=0)
+    method: str = Field(default="auto")  # "auto" or "manual"
+    # Categories before linking, put back when the pair is unlinked
+    outgoing_prev_category_id: Optional[int] = Field(default=None)
+    incoming_prev_category_id: Optional[int] = Field(default=None)
+
+
+class Watermark(SQLModel, table=True):
+    """Highest transaction id a background scan has already looked at."""
+
+    __table_args__ = {"extend_existing": True}
+    name: str = Field(primary_key=True)
+    value: int = Field(default=0)
+
+
+class Meta(SQLModel, table=True):
+    """Facts about the database file itself, e.g. how amounts are scaled."""
+
+    __table_args__ = {"extend_existing": True}
+    key: str = Field(primary_key=True)
+    value: str
+
 
 class Note(SQLModel, table=True):
     __table_args__ = {"extend_existing": True}
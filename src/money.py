@@ -0,0 +1,100 @@
+from decimal import ROUND_HALF_UP, Decimal
+
+from sqlalchemy import text
+from sqlalchemy.types import Integer, TypeDecorator
+
+from src.config import load_settings
+
+# ISO 4217 minor units; anything not listed uses cents
+CURRENCY_EXPONENTS = {
+    "EUR": 2,
+    "USD": 2,
+    "GBP": 2,
+    "CHF": 2,
+    "JPY": 0,
+    "KRW": 0,
+    "BHD": 3,
+    "KWD": 3,
+}
+
+
+def currency_exponent(currency=None):
+    currency = currency or load_settings().get("currency", "EUR")
+    return CURRENCY_EXPONENTS.get(currency.upper(), 2)
+
+
+# Fixed for the life of the database: stored integers are read with it.
+# The database records the exponent its amounts were written with (see
+# `check_exponent`) and is not opened when the setting disagrees.
+EXPONENT = currency_exponent()
+SCALE = 10**EXPONENT
+
+EXPONENT_KEY = "money_exponent"
+
+
+class CurrencyMismatch(ValueError):
+    """The database stores amounts with another number of decimals."""
+
+
+# --- STORED EXPONENT ---
+def stored_exponent(conn):
+    """Exponent recorded in the database's meta table, or None."""
+    value = conn.execute(
+        text("SELECT value FROM meta WHERE key = :key"), {"key": EXPONENT_KEY}
+    ).scalar()
+    return None if value is None else int(value)
+
+
+def record_exponent(conn, exponent=EXPONENT):
+    """Records the exponent amounts are stored with, unless one already is."""
+    conn.execute(
+        text("INSERT OR IGNORE INTO meta (key, value) VALUES (:key, :value)"),
+        {"key": EXPONENT_KEY, "value": str(exponent)},
+    )
+
+
+def check_exponent(conn):
+    """Raises CurrencyMismatch when the database disagrees with the setting."""
+    stored = stored_exponent(conn)
+    if stored is not None and stored != EXPONENT:
+        currency = load_settings().get("currency", "EUR")
+        raise CurrencyMismatch(
+            f"This database stores amounts with {stored} decimals, but the "
+            f"currency setting ({currency}) uses {EXPONENT}. Opening it would "
+            "misread every amount: set the currency in data/settings.json "
+            "back, or start a new database for the other currency."
+        )
+
+
+def to_minor(value, exponent=EXPONENT):
+    """12.1, "12.10" and Decimal("12.1") all become 1210 (for cents)."""
+    amount = value if isinstance(value, Decimal) else Decimal(str(value))
+    return int(amount.scaleb(exponent).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+def from_minor(units, exponent=EXPONENT):
+    return Decimal(int(units)).scaleb(-exponent)
+
+
+def minor_series(amounts, exponent=EXPONENT):
+    """Vectorized `to_minor` for a float column (exact for amounts below 2**53 / 10**exponent)."""
+    return (amounts * 10**exponent).round().astype("int64")
+
+
+class Money(TypeDecorator):
+    """
+    Amount stored as an INTEGER count of minor units and exposed to Python
+    as a Decimal in major units. Aggregates over it (func.sum) come back
+    as Decimals too, so totals are exact.
+    """
+
+    impl = Integer
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        return None if value is None else to_minor(value)
+
+    def process_result_value(self, value, dialect):
+        # int() also accepts the integral REAL values SQLite returns for SUM
+        # over legacy FLOAT-declared columns
+        return None if value is None else from_minor(value)
@@ -0,0 +1,73 @@
+from sqlalchemy import delete, update
+
+from src.models import Transaction
+
+# Bulk writes by primary key, for the editors that change many rows at
+# once. Each helper issues a fixed number of statements whatever the row
+# count: one executemany UPDATE per changed column, or one UPDATE/DELETE
+# with an id list. Nothing is loaded into the session and nothing is
+# committed, so several calls share one transaction; the caller commits.
+
+# SQLite builds before 3.32 allow 999 bound parameters per statement.
+# Every IN list in the app is split with `chunked` to stay below it.
+MAX_IDS = 900
+
+
+def chunked(values, size=MAX_IDS):
+    """`values` as consecutive lists of at most `size`, e.g. for IN lists."""
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start : start + size]
+
+
+# --- DIFFS ---
+def changed_rows(original, edited, column):
+    """
+    Rows of `edited` whose `column` differs from the same row (by index)
+    of `original`, e.g. the frame shown in st.data_editor and its result.
+    `edited` may be a subset of the rows.
+    """
+    before = original[column].astype(object).reindex(edited.index)
+    after = edited[column].astype(object)
+    differs = (before != after) & ~(before.isna() & after.isna())
+    return edited.loc[differs[differs].index]
+
+
+# --- WRITES ---
+def update_values(session, column, values):
+    """
+    Sets `column` to `values[id]` for each id: one executemany UPDATE.
+    `column` is a model attribute such as Transaction.category_id.
+    Returns the number of rows written.
+    """
+    if not values:
+        return 0
+    model = column.class_
+    rows = [{"id": int(i), column.key: v} for i, v in values.items()]
+    session.execute(update(model), rows)
+    return len(rows)
+
+
+def set_value(session, column, ids, value):
+    """Sets `column` to the same `value` on every id in `ids`."""
+    model = column.class_
+    count = 0
+    for chunk in chunked(int(i) for i in ids):
+        result = session.execute(
+            update(model).where(model.id.in_(chunk)).values({column.key: value}),
+            execution_options={"synchronize_session": False},
+        )
+        count += result.rowcount
+    return count
+
+
+def delete_rows(session, ids, model=Transaction):
+    """Deletes the rows of `model` with these ids."""
+    count = 0
+    for chunk in chunked(int(i) for i in ids):
+        result = session.execute(
+            delete(model).where(model.id.in_(chunk)),
+            execution_options={"synchronize_session": False},
+        )
+        count += result.rowcount
+    return count
@@ -0,0 +1,443 @@
+from datetime import date as Date
+from decimal import Decimal
+from typing import NamedTuple, Optional
+
+import pandas as pd
+from sqlalchemy import Integer, String, and_, case, or_, type_coerce
+from sqlalchemy import Date as DateType
+from sqlalchemy.orm import aliased
+from sqlmodel import func, select
+
+from src.cache import cached
+from src.dates import month_key
+from src.models import (
+    Account,
+    Budget,
+    Category,
+    Merchant,
+    MonthlySummary,
+    Transaction,
+    TransferLink,
+)
+from src.money import SCALE, to_minor
+from src.search import SEARCH_LIMIT, description_filter, matches
+
+# Named read queries for the pages. Each one returns a DataFrame built
+# straight from the cursor rows: amounts are read as raw minor units and
+# dates as ISO text, then converted column-wise, so no ORM objects or
+# per-row Decimal/date conversions are created. Queries with plain
+# arguments are cached until the next write (see src/cache.py).
+
+TRANSACTION_COLUMNS = [
+    "id",
+    "date",
+    "description",
+    "amount",
+    "account",
+    "category",
+    "account_id",
+    "category_id",
+    "is_virtual",
+    "is_settled",
+]
+
+
+# --- HELPERS ---
+def raw(column, label=None):
+    """`column` without its Python-side type processing (Money, Date)."""
+    kind = String if isinstance(column.type, DateType) else Integer
+    return type_coerce(column, kind).label(label or column.key)
+
+
+def read_frame(session, statement, money=("amount",), dates=("date",)):
+    """Runs `statement` and converts its minor-unit and ISO date columns in bulk."""
+    result = session.connection().execute(statement)
+    df = pd.DataFrame(result.fetchall(), columns=list(result.keys()))
+    for col in money:
+        if col in df:
+            df[col] = df[col].astype("float64") / SCALE
+    for col in dates:
+        if col in df:
+            df[col] = pd.to_datetime(df[col], format="%Y-%m-%d")
+    return df
+
+
+def as_categorical(series, names, fill):
+    """Fills missing labels and fixes the categories to the full name list."""
+    categories = list(dict.fromkeys([*names, fill]))
+    return series.fillna(fill).astype(pd.CategoricalDtype(categories))
+
+
+def amount_units(text):
+    """
+    Minor units of a search box entry that is a plain amount ("12.5"), or
+    None for text, NaN, infinities and values no INTEGER column can hold.
+    """
+    try:
+        amount = Decimal(text.strip())
+        if not amount.is_finite():
+            return None
+        units = to_minor(amount)
+    except (ArithmeticError, ValueError):
+        # InvalidOperation/Overflow from parsing or rescaling
+        return None
+    return units if abs(units) < 2**63 else None
+
+
+def _names(session, model):
+    return session.exec(select(model.name).order_by(model.name)).all()
+
+
+# --- QUERIES ---
+def transactions(session, *where, order_by=None, limit=None):
+    """
+    Transactions matching the `where` clauses, with account and category
+    names as categoricals (missing ones read "Unknown"/"Uncategorized").
+    """
+    statement = (
+        select(
+            Transaction.id,
+            raw(Transaction.date),
+            Transaction.description,
+            raw(Transaction.amount),
+            Account.name.label("account"),
+            Category.name.label("category"),
+            Transaction.account_id,
+            Transaction.category_id,
+            Transaction.is_virtual,
+            Transaction.is_settled,
+        )
+        .outerjoin(Account, Transaction.account_id == Account.id)
+        .outerjoin(Category, Transaction.category_id == Category.id)
+        .where(*where)
+    )
+    if order_by is not None:
+        if not isinstance(order_by, tuple):
+            order_by = (order_by,)
+        statement = statement.order_by(*order_by)
+    if limit is not None:
+        statement = statement.limit(limit)
+    df = read_frame(session, statement)
+    if df.empty:
+        df = pd.DataFrame(columns=TRANSACTION_COLUMNS)
+    df["account"] = as_categorical(df["account"], _names(session, Account), "Unknown")
+    df["category"] = as_categorical(
+        df["category"], _names(session, Category), "Uncategorized"
+    )
+    return df
+
+
+@cached()
+def description_counts(session):
+    """Distinct transaction descriptions and how many rows share each one."""
+    statement = select(Transaction.description, func.count().label("count")).group_by(
+        Transaction.description
+    )
+    return read_frame(session, statement)
+
+
+@cached()
+def description_categories(session):
+    """Transaction count per (description, category_id), for rule dry runs."""
+    statement = select(
+        Transaction.description, Transaction.category_id, func.count().label("count")
+    ).group_by(Transaction.description, Transaction.category_id)
+    return read_frame(session, statement)
+
+
+# --- TRANSACTION MANAGER ---
+class TransactionFilter(NamedTuple):
+    """Hashable filter state of the Transaction Manager."""
+
+    start: Optional[Date] = None  # half-open [start, end)
+    end: Optional[Date] = None
+    category_ids: tuple = ()
+    search: str = ""  # search box entry, see src/search.py
+    regex: bool = False  # treat `search` as a regular expression
+    amount_op: str = "Any"  # "Any", ">", "<" or "="
+    amount: float = 0.0
+
+
+def filter_conditions(session, flt):
+    """WHERE clauses for `flt`, all evaluated by SQLite."""
+    where = []
+    if flt.category_ids:
+        where.append(Transaction.category_id.in_(flt.category_ids))
+    if flt.start is not None:
+        where.append(Transaction.date >= flt.start)
+    if flt.end is not None:
+        where.append(Transaction.date < flt.end)
+    match = description_filter(session, flt.search, flt.regex)
+    if match is not None:
+        where.append(match)
+    amount = Decimal(str(flt.amount))
+    if flt.amount_op == ">":
+        where.append(Transaction.amount > amount)
+    elif flt.amount_op == "<":
+        where.append(Transaction.amount < amount)
+    elif flt.amount_op == "=":
+        where.append(Transaction.amount == amount)
+    return where
+
+
+# Sort name -> (column, descending). Ties are broken by id in the same
+# direction, so (column, id) is a unique keyset cursor.
+SORTS = {
+    "Newest first": (Transaction.date, True),
+    "Oldest first": (Transaction.date, False),
+    "Largest expense first": (Transaction.amount, False),
+    "Largest income first": (Transaction.amount, True),
+}
+
+
+@cached()
+def count_transactions(session, flt):
+    statement = (
+        select(func.count())
+        .select_from(Transaction)
+        .where(*filter_conditions(session, flt))
+    )
+    return session.exec(statement).one()
+
+
+@cached()
+def transaction_page(session, flt, sort, cursor=None, page_size=100):
+    """
+    One page of the filtered transactions in `sort` order, starting after
+    `cursor` (the `page_cursor` of the previous page). Seeks straight to
+    the page, so deep pages cost the same as the first one.
+    """
+    column, descending = SORTS[sort]
+    key = raw(column)
+    where = filter_conditions(session, flt)
+    if cursor is not None:
+        value, last_id = cursor
+        if descending:
+            after = or_(key < value, and_(key == value, Transaction.id < last_id))
+        else:
+            after = or_(key > value, and_(key == value, Transaction.id > last_id))
+        where.append(after)
+    order = (key.desc(), Transaction.id.desc()) if descending else (key, Transaction.id)
+    return transactions(session, *where, order_by=order, limit=page_size)
+
+
+def page_cursor(page, sort):
+    """Cursor for the page after `page`, in raw column values."""
+    last = page.iloc[-1]
+    if SORTS[sort][0] is Transaction.date:
+        value = last["date"].strftime("%Y-%m-%d")
+    else:
+        value = int(round(last["amount"] * SCALE))
+    return value, int(last["id"])
+
+
+@cached()
+def filtered_category_totals(session, flt):
+    """Spending (positive) and income per category over the whole filter."""
+    amount = raw(Transaction.amount)
+    statement = (
+        select(
+            Category.name.label("category"),
+            type_coerce(func.sum(case((amount < 0, -amount), else_=0)), Integer).label(
+                "spend"
+            ),
+            type_coerce(func.sum(case((amount > 0, amount), else_=0)), Integer).label(
+                "income"
+            ),
+        )
+        .select_from(Transaction)
+        .outerjoin(Category, Transaction.category_id == Category.id)
+        .where(*filter_conditions(session, flt))
+        .group_by(Category.id)
+    )
+    df = read_frame(session, statement, money=("spend", "income"))
+    df["category"] = as_categorical(
+        df["category"], _names(session, Category), "Uncategorized"
+    )
+    return df
+
+
+@cached()
+def filtered_merchant_totals(session, flt, limit=10):
+    """The `limit` merchants with the most spending (positive) over the filter."""
+    amount = raw(Transaction.amount)
+    spend = type_coerce(func.sum(case((amount < 0, -amount), else_=0)), Integer)
+    statement = (
+        select(Merchant.key.label("merchant"), spend.label("spend"))
+        .select_from(Transaction)
+        .join(Merchant, Transaction.merchant_id == Merchant.id)
+        .where(*filter_conditions(session, flt))
+        .group_by(Merchant.id)
+        .having(spend > 0)
+        .order_by(spend.desc())
+        .limit(limit)
+    )
+    return read_frame(session, statement, money=("spend",))
+
+
+@cached()
+def reservations(session):
+    """Virtual transactions not yet settled against a real payment."""
+    return transactions(
+        session, Transaction.is_virtual == True, Transaction.is_settled == False
+    )
+
+
+@cached()
+def real_expenses(session, exclude_category_id=None, search=None):
+    """
+    Real outgoing payments, newest first, optionally without one category.
+    With a `search` entry, only the SEARCH_LIMIT newest matches.
+    """
+    where = [
+        Transaction.is_virtual == False,
+        Transaction.amount < 0,
+        Transaction.category_id != exclude_category_id,
+    ]
+    match = matches(session, search or "")
+    if match is not None:
+        where.append(match)
+    return transactions(
+        session,
+        *where,
+        order_by=Transaction.date.desc(),
+        limit=SEARCH_LIMIT if match is not None else None,
+    )
+
+
+@cached()
+def link_candidates(session, exclude_category_id, search=None, limit=50):
+    """Newest transactions outside one category, for the manual transfer link."""
+    where = [Transaction.category_id != exclude_category_id]
+    match = matches(session, search or "")
+    if match is not None:
+        units = amount_units(search)
+        if units is None:
+            where.append(match)
+        else:
+            # A number also finds transactions of that amount (either sign)
+            stored = type_coerce(Transaction.amount, Integer)
+            where.append(or_(match, stored.in_([units, -units])))
+    return transactions(session, *where, order_by=Transaction.date.desc(), limit=limit)
+
+
+@cached()
+def transfer_links(session):
+    """Recorded transfer pairs with both sides' date, description and amount."""
+    out_tx, in_tx = aliased(Transaction), aliased(Transaction)
+    statement = (
+        select(
+            TransferLink.id,
+            TransferLink.method,
+            TransferLink.delta_days,
+            raw(out_tx.date, "out_date"),
+            out_tx.description.label("out_description"),
+            raw(out_tx.amount, "out_amount"),
+            raw(in_tx.date, "in_date"),
+            in_tx.description.label("in_description"),
+            raw(in_tx.amount, "in_amount"),
+        )
+        .join(out_tx, TransferLink.outgoing_tx_id == out_tx.id)
+        .join(in_tx, TransferLink.incoming_tx_id == in_tx.id)
+        .order_by(out_tx.date.desc(), TransferLink.id.desc())
+    )
+    return read_frame(
+        session,
+        statement,
+        money=("out_amount", "in_amount"),
+        dates=("out_date", "in_date"),
+    )
+
+
+@cached()
+def month_category_totals(session, year, month):
+    """
+    Income and spend per category for one month, read from the
+    trigger-maintained monthly summary: one row per category and
+    direction, with columns category_name, group, type, amount.
+    """
+    statement = (
+        select(
+            Category.name.label("category_name"),
+            Category.group,
+            type_coerce(func.sum(MonthlySummary.income), Integer).label("Income"),
+            type_coerce(func.sum(MonthlySummary.spend), Integer).label("Expense"),
+        )
+        .join(Category, MonthlySummary.category_id == Category.id)
+        .where(MonthlySummary.month == month_key(year, month))
+        .group_by(Category.id)
+    )
+    wide = read_frame(session, statement, money=("Income", "Expense"))
+    df = wide.melt(
+        id_vars=["category_name", "group"],
+        value_vars=["Income", "Expense"],
+        var_name="type",
+        value_name="amount",
+    )
+    df = df[df["amount"] != 0].reset_index(drop=True)
+    df["category_name"] = as_categorical(
+        df["category_name"], _names(session, Category), "Uncategorized"
+    )
+    return df
+
+
+@cached()
+def budgets(session):
+    """Global budget per category: columns category_name, amount."""
+    statement = select(Category.name.label("category_name"), raw(Budget.amount)).join(
+        Category, Budget.category_id == Category.id
+    )
+    return read_frame(session, statement)
+
+
+# Unsettled, non-transfer rows paid from an account other than their
+# category's default one (categories without a default never match)
+UNSETTLED_MISMATCH = (
+    Transaction.is_settled == False,
+    Category.group != "Transfers",
+    Category.default_account_id != None,
+    Transaction.account_id != Category.default_account_id,
+)
+
+
+@cached()
+def unsettled_mismatches(session):
+    """Misaligned transactions; `intended_acct` owes `payer_acct`."""
+    intended = Account.__table__.alias("intended")
+    statement = (
+        select(
+            Transaction.id.label("tx_id"),
+            raw(Transaction.date),
+            Transaction.description,
+            raw(Transaction.amount),
+            Category.name.label("category"),
+            Account.name.label("payer_acct"),
+            intended.c.name.label("intended_acct"),
+        )
+        .join(Category, Transaction.category_id == Category.id)
+        .join(Account, Transaction.account_id == Account.id)
+        .join(intended, Category.default_account_id == intended.c.id)
+        .where(*UNSETTLED_MISMATCH)
+    )
+    df = read_frame(session, statement)
+    accounts = _names(session, Account)
+    for col in ("payer_acct", "intended_acct"):
+        df[col] = as_categorical(df[col], accounts, "Unknown")
+    return df
+
+
+@cached()
+def unsettled_totals(session):
+    """Exact Decimal total per (intended_acct, payer_acct) name pair."""
+    intended = Account.__table__.alias("intended")
+    statement = (
+        select(intended.c.name, Account.name, func.sum(Transaction.amount))
+        .join(Category, Transaction.category_id == Category.id)
+        .join(Account, Transaction.account_id == Account.id)
+        .join(intended, Category.default_account_id == intended.c.id)
+        .where(*UNSETTLED_MISMATCH)
+        .group_by(intended.c.id, Account.id)
+    )
+    return {
+        (debtor, creditor): total for debtor, creditor, total in session.exec(statement)
+    }
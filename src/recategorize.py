@@ -0,0 +1,71 @@
+import re
+
+import pandas as pd
+from sqlalchemy import or_
+from sqlmodel import func, select
+
+from src import mutations
+from src.models import Transaction
+from src.rules import disabled_reason, is_literal
+from src.search import description_filter
+
+# Transactions read, matched and written per step of a job
+BATCH_SIZE = 1000
+
+
+def affected_by(session, keywords):
+    """
+    WHERE clause for the transactions whose description matches any of
+    `keywords` the way the rule engine does (case-insensitive search),
+    or None when there are none. Disabled patterns are skipped.
+    """
+    clauses = []
+    for keyword in keywords:
+        # A refused pattern could hang SQLite's REGEXP on every row
+        if disabled_reason(keyword) is not None:
+            continue
+        pattern = re.escape(keyword) if is_literal(keyword) else keyword
+        clause = description_filter(session, pattern, regex=True)
+        if clause is not None:
+            clauses.append(clause)
+    return or_(*clauses) if clauses else None
+
+
+def apply_rules(session, rule_engine, where=(), batch_size=BATCH_SIZE, on_batch=None):
+    """
+    Re-categorizes the transactions matching `where` with `rule_engine`,
+    walking them in id order one batch at a time. Rows no rule matches
+    keep their category. Each batch is written with one bulk UPDATE and
+    committed, so the database is never locked for the whole history.
+    `on_batch(rows_done, rows_total)` is called after every batch.
+    Returns the number of transactions changed.
+    """
+    total = session.exec(
+        select(func.count()).select_from(Transaction).where(*where)
+    ).one()
+    done, updated, last_id = 0, 0, 0
+    while True:
+        # Keyset paging: each batch seeks past the last id seen
+        batch = session.exec(
+            select(Transaction.id, Transaction.description, Transaction.category_id)
+            .where(*where, Transaction.id > last_id)
+            .order_by(Transaction.id)
+            .limit(batch_size)
+        ).all()
+        if not batch:
+            break
+        ids, descriptions, current = zip(*batch)
+        matched = rule_engine.categorize(pd.Series(descriptions, dtype=object))
+        changes = {
+            tx_id: int(new)
+            for tx_id, new, old in zip(ids, matched, current)
+            if pd.notna(new) and new != old
+        }
+        updated += mutations.update_values(session, Transaction.category_id, changes)
+        session.commit()
+
+        done += len(batch)
+        last_id = ids[-1]
+        if on_batch:
+            on_batch(done, total)
+    return updated
@@ -0,0 +1,611 @@
+import functools
+import re
+import time
+from difflib import SequenceMatcher
+from typing import NamedTuple
+
+import numpy as np
+import pandas as pd
+from sqlmodel import select
+
+from src.models import CategoryRule
+
+try:
+    from re import _constants as sre, _parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_constants as sre
+    import sre_parse
+
+# Characters that make a keyword a real regular expression
+REGEX_META = set("()[]{}?*+|^$\\.")
+
+
+def is_literal(keyword):
+    return not any(ch in REGEX_META for ch in keyword)
+
+
+class LiteralMatcher:
+    """
+    Aho-Corasick automaton over lowercased keywords.
+
+    `first_match` scans a text once and returns the smallest rule position
+    among all keywords it contains, regardless of how many keywords exist.
+    """
+
+    def __init__(self, keywords):
+        # keywords: iterable of (position, keyword)
+        self.goto = [{}]
+        self.best = [None]  # lowest rule position ending in each state
+
+        for pos, keyword in keywords:
+            state = 0
+            for ch in keyword.lower():
+                nxt = self.goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(self.goto)
+                    self.goto.append({})
+                    self.best.append(None)
+                    self.goto[state][ch] = nxt
+                state = nxt
+            if self.best[state] is None or pos < self.best[state]:
+                self.best[state] = pos
+
+        # Breadth-first pass: failure links, and fold the outputs of each
+        # state's failure chain into its own `best`.
+        self.fail = [0] * len(self.goto)
+        queue = list(self.goto[0].values())
+        for state in queue:
+            for ch, nxt in self.goto[state].items():
+                f = self.fail[state]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                target = self.goto[f].get(ch, 0)
+                self.fail[nxt] = target if target != nxt else 0
+                inherited = self.best[self.fail[nxt]]
+                if inherited is not None and (
+                    self.best[nxt] is None or inherited < self.best[nxt]
+                ):
+                    self.best[nxt] = inherited
+                queue.append(nxt)
+
+    def first_match(self, text):
+        goto, fail, best = self.goto, self.fail, self.best
+        state = 0
+        found = None
+        for ch in text.lower():
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            hit = best[state]
+            if hit is not None and (found is None or hit < found):
+                found = hit
+        return found
+
+
+class RuleEngine:
+    """
+    Compiled form of an ordered rule set with first-match semantics.
+
+    Plain keywords go through a single Aho-Corasick pass that yields the
+    earliest matching literal rule. Keywords that are real regexes are
+    compiled once and evaluated in order, and only when they come before
+    that literal winner.
+    """
+
+    def __init__(self, rules):
+        # rules: iterable of (keyword, category_id), in priority order
+        self.category_ids = []
+        self.regexes = []  # (position, compiled pattern)
+        literals = []
+
+        for keyword, category_id in rules:
+            if not keyword:
+                continue
+            pos = len(self.category_ids)
+            if is_literal(keyword):
+                literals.append((pos, keyword))
+            else:
+                try:
+                    self.regexes.append((pos, re.compile(keyword, re.IGNORECASE)))
+                except re.error:
+                    continue  # Skip bad rules
+            self.category_ids.append(category_id)
+
+        self.literals = LiteralMatcher(literals) if literals else None
+
+    def match_position(self, description):
+        """Index of the first rule matching `description`, or None."""
+        first_literal = None
+        if self.literals is not None:
+            first_literal = self.literals.first_match(description)
+
+        for pos, pattern in self.regexes:
+            if first_literal is not None and pos > first_literal:
+                break
+            if pattern.search(description):
+                return pos
+        return first_literal
+
+    def match(self, description):
+        pos = self.match_position(description)
+        return None if pos is None else self.category_ids[pos]
+
+    def categorize(self, descriptions, default_id=None):
+        """Category per row of `descriptions`, evaluating each distinct text once."""
+        assigned = {d: self.match(d) for d in pd.unique(descriptions)}
+        result = descriptions.map(assigned).astype("Int64")
+        if default_id is not None:
+            result = result.fillna(default_id)
+        return result
+
+
+_engine_cache = {"key": None, "engine": None}
+
+
+def get_rule_engine(session):
+    """Returns the compiled engine for the current rules table, rebuilt only when it changes."""
+    rows = session.exec(
+        select(
+            CategoryRule.id, CategoryRule.keyword, CategoryRule.category_id
+        ).order_by(CategoryRule.id)
+    ).all()
+    key = tuple(tuple(r) for r in rows)
+    if _engine_cache["key"] != key:
+        rules = [(kw, cat_id) for _, kw, cat_id in rows]
+        _engine_cache["engine"] = RuleEngine(
+            (kw, cat_id) for _, kw, cat_id in active_rules(rules)
+        )
+        _engine_cache["key"] = key
+    return _engine_cache["engine"]
+
+
+def changed_keywords(old_rules, new_rules):
+    """
+    Keywords whose edit can change a first-match result, given the rule
+    lists before and after an edit as (keyword, category_id) in priority
+    order: added and removed rules, and rules that moved relative to the
+    others. A description matching none of them keeps its category, since
+    the rules it matches are the same and in the same order. Disabled
+    rules never categorize anything, so they are left out (see
+    `active_rules`).
+    """
+    old_rules = [(kw, cat) for _, kw, cat in active_rules(list(old_rules))]
+    new_rules = [(kw, cat) for _, kw, cat in active_rules(list(new_rules))]
+    kept_old, kept_new = set(), set()
+    matcher = SequenceMatcher(None, old_rules, new_rules, autojunk=False)
+    for a, b, size in matcher.get_matching_blocks():
+        kept_old.update(range(a, a + size))
+        kept_new.update(range(b, b + size))
+    changed = [kw for i, (kw, _) in enumerate(old_rules) if i not in kept_old]
+    changed += [kw for i, (kw, _) in enumerate(new_rules) if i not in kept_new]
+    return sorted(set(changed))
+
+
+# --- SAFETY ---
+# Python's re backtracks: a quantifier over something that can itself
+# match a variable length, like (a+)+ or (\w+\s?)*, or over alternatives
+# that can start the same way, like (a|b|ab)*, can take exponential time
+# on a near miss. Such patterns are refused when rules are saved, and
+# every other pattern must also get through a few adversarial probes
+# within PROBE_BUDGET seconds each.
+PROBE_BUDGET = 0.05
+PROBE_LENGTHS = tuple(range(8, 33, 2))
+PROBE_CHARS = "a1 ."
+# Longest literal piece of a pattern repeated as a probe unit
+MAX_UNIT = 8
+
+_REPEATS = {sre.MAX_REPEAT, sre.MIN_REPEAT}
+_SAFE = {
+    getattr(sre, op) for op in ("POSSESSIVE_REPEAT", "ATOMIC_GROUP") if hasattr(sre, op)
+}
+
+# First characters are worked out over Latin-1; anything else is assumed
+# to be startable by every class that is not an explicit character list
+_ALPHABET = frozenset(map(chr, range(256)))
+_CATEGORIES = {
+    sre.CATEGORY_DIGIT: r"\d",
+    sre.CATEGORY_NOT_DIGIT: r"\D",
+    sre.CATEGORY_SPACE: r"\s",
+    sre.CATEGORY_NOT_SPACE: r"\S",
+    sre.CATEGORY_WORD: r"\w",
+    sre.CATEGORY_NOT_WORD: r"\W",
+}
+
+
+def _children(op, av):
+    if op == sre.SUBPATTERN:
+        return [av[-1]]
+    if op == sre.BRANCH:
+        return av[1]
+    if op in (sre.ASSERT, sre.ASSERT_NOT):
+        return [av[1]]
+    if op == sre.GROUPREF_EXISTS:
+        return [branch for branch in av[1:] if branch]
+    return []
+
+
+def _nested_repeat(items, in_repeat=False):
+    for op, av in items:
+        if op in _SAFE:
+            continue
+        if op in _REPEATS:
+            low, high, sub = av
+            if in_repeat and low != high:
+                return True
+            if _nested_repeat(sub, in_repeat or high > 1):
+                return True
+        elif any(_nested_repeat(child, in_repeat) for child in _children(op, av)):
+            return True
+    return False
+
+
+def _cased(ch):
+    return {ch, ch.lower(), ch.upper()}
+
+
+@functools.lru_cache(maxsize=None)
+def _category_chars(category):
+    pattern = _CATEGORIES.get(category)
+    if pattern is None:
+        return _ALPHABET
+    return frozenset(ch for ch in _ALPHABET if re.match(pattern, ch))
+
+
+def _class_chars(items):
+    """Characters an IN node (a [...] class) matches, case-insensitively."""
+    chars, negate = set(), False
+    for op, av in items:
+        if op == sre.NEGATE:
+            negate = True
+        elif op == sre.LITERAL:
+            chars |= _cased(chr(av))
+        elif op == sre.RANGE:
+            for code in range(av[0], min(av[1], 255) + 1):
+                chars |= _cased(chr(code))
+        elif op == sre.CATEGORY:
+            chars |= _category_chars(av)
+        else:
+            return _ALPHABET
+    return _ALPHABET - chars if negate else chars
+
+
+def _first_chars(items):
+    """
+    (characters a match of `items` can start with, whether it can be
+    empty). Over-approximates: unknown constructs can start with anything.
+    """
+    first = set()
+    for op, av in items:
+        if op == sre.LITERAL:
+            return first | _cased(chr(av)), False
+        if op == sre.NOT_LITERAL:
+            return first | (_ALPHABET - _cased(chr(av))), False
+        if op == sre.IN:
+            return first | _class_chars(av), False
+        if op in (sre.AT, sre.ASSERT, sre.ASSERT_NOT):
+            continue  # zero width
+        if op in _REPEATS or op == getattr(sre, "POSSESSIVE_REPEAT", None):
+            chars, empty = _first_chars(av[2])
+            first |= chars
+            if av[0] > 0 and not empty:
+                return first, False
+        elif op == sre.SUBPATTERN or op == getattr(sre, "ATOMIC_GROUP", None):
+            chars, empty = _first_chars(av[-1] if op == sre.SUBPATTERN else av)
+            first |= chars
+            if not empty:
+                return first, False
+        elif op == sre.BRANCH:
+            results = [_first_chars(branch) for branch in av[1]]
+            first |= set().union(*(chars for chars, _ in results))
+            if not any(empty for _, empty in results):
+                return first, False
+        else:
+            return first | _ALPHABET, False
+    return first, True
+
+
+def _overlapping_branch(items, in_repeat=False, follow=frozenset()):
+    """
+    Whether a repeated alternation has two alternatives that can start
+    with the same character, like (a|b|ab)* or (a|aa)+: the engine may
+    then split a run of text between them in exponentially many ways.
+    An alternative that can be empty starts like whatever follows it,
+    `follow` being what may come after `items` inside the repeat.
+    """
+    for i, (op, av) in enumerate(items):
+        if op in _SAFE:
+            continue
+        rest, empty = _first_chars(items[i + 1 :])
+        after = rest | follow if empty else rest
+        if op in _REPEATS:
+            low, high, sub = av
+            # The body may be followed by itself again
+            body = _first_chars(sub)[0] | after if high > 1 else after
+            if _overlapping_branch(sub, in_repeat or high > 1, body):
+                return True
+            continue
+        if op == sre.BRANCH and in_repeat:
+            seen = set()
+            for branch in av[1]:
+                chars, branch_empty = _first_chars(branch)
+                if branch_empty:
+                    chars = chars | after
+                if seen & chars:
+                    return True
+                seen |= chars
+        if any(
+            _overlapping_branch(child, in_repeat, after) for child in _children(op, av)
+        ):
+            return True
+    return False
+
+
+def _literal_pieces(items):
+    """Runs of literal characters anywhere in a parsed pattern."""
+    pieces, run = [], ""
+    for op, av in items:
+        if op == sre.LITERAL:
+            run += chr(av)
+            continue
+        if run:
+            pieces.append(run)
+            run = ""
+        if op in _REPEATS or op == getattr(sre, "POSSESSIVE_REPEAT", None):
+            pieces += _literal_pieces(av[2])
+        elif op == getattr(sre, "ATOMIC_GROUP", None):
+            pieces += _literal_pieces(av)
+        else:
+            for child in _children(op, av):
+                pieces += _literal_pieces(child)
+    if run:
+        pieces.append(run)
+    return pieces
+
+
+def _probes(pattern, parsed, length):
+    """
+    Near-miss texts: runs of one character, then repeats of the pattern's
+    literal pieces and of pairs of them ("ab", "a" + "b"), each followed by
+    a character that breaks the match.
+    """
+    prefix = ""
+    for op, av in parsed:
+        if op != sre.LITERAL:
+            break
+        prefix += chr(av)
+    chars = set(PROBE_CHARS) | {ch for ch in pattern if ch.isalnum()}
+    for ch in sorted(chars):
+        yield prefix + ch * length + "\x00"
+
+    pieces = sorted({p[:MAX_UNIT] for p in _literal_pieces(parsed)})
+    units = set(pieces) | {a + b for a in pieces for b in pieces if a != b}
+    for unit in sorted(units):
+        if len(unit) > 1:
+            yield prefix + unit * length + "\x00"
+
+
+@functools.lru_cache(maxsize=1024)
+def static_problem(keyword):
+    """
+    Why `keyword` is unsafe judging by its structure alone, or None.
+    Deterministic, so stored rules can be checked with it on every load.
+    """
+    if is_literal(keyword):
+        return None
+    try:
+        parsed = sre_parse.parse(keyword, re.IGNORECASE)
+        re.compile(keyword, re.IGNORECASE)
+    except re.error as e:
+        return f"invalid regex: {e}"
+    if _nested_repeat(parsed):
+        return "nested quantifiers, e.g. (a+)+, can take exponential time"
+    if _overlapping_branch(parsed):
+        return (
+            "repeated alternatives that start alike, e.g. (a|b|ab)*, "
+            "can take exponential time"
+        )
+    return None
+
+
+def _too_slow(pattern, text):
+    # Twice over budget, so one GC pause or busy thread is not enough
+    for _ in range(2):
+        start = time.perf_counter()
+        pattern.search(text)
+        if time.perf_counter() - start <= PROBE_BUDGET:
+            return False
+    return True
+
+
+def regex_problem(keyword):
+    """
+    Why `keyword` cannot be saved as a rule, or None if it is fine: the
+    static checks, then timed probes. Timings vary with machine load, so
+    this runs when rules are saved, never when stored ones are loaded.
+    """
+    problem = static_problem(keyword)
+    if problem or is_literal(keyword):
+        return problem
+    pattern = re.compile(keyword, re.IGNORECASE)
+    parsed = sre_parse.parse(keyword, re.IGNORECASE)
+    for length in PROBE_LENGTHS:
+        for text in _probes(keyword, parsed, length):
+            if _too_slow(pattern, text):
+                return "too slow on near-miss input"
+    return None
+
+
+def disabled_reason(keyword):
+    """Why a stored rule is not evaluated (empty, or a static_problem), or None."""
+    if not keyword:
+        return "empty"
+    return static_problem(keyword)
+
+
+def active_rules(rules):
+    """
+    (position, keyword, category_id) of the rules in `rules`, given as
+    (keyword, category_id), that are evaluated: the rule engine, dry runs
+    and profiles all skip the disabled ones, including rules saved before
+    a check existed.
+    """
+    return [
+        (pos, keyword, category_id)
+        for pos, (keyword, category_id) in enumerate(rules)
+        if disabled_reason(keyword) is None
+    ]
+
+
+# --- PROFILING ---
+def _contains(keyword, texts, lowered):
+    """
+    Whether each of `texts` matches `keyword` the way RuleEngine does,
+    in one vectorized pass. `lowered` is texts.str.lower().
+    """
+    if is_literal(keyword):
+        return lowered.str.contains(keyword.lower(), regex=False).to_numpy(bool)
+    # A compiled search rather than str.contains, which warns about every
+    # pattern with capture groups
+    search = re.compile(keyword, re.IGNORECASE).search
+    return np.fromiter(
+        (search(text) is not None for text in texts), dtype=bool, count=len(texts)
+    )
+
+
+def profile_rules(rules, descriptions, counts=None):
+    """
+    Per-rule statistics of an ordered rule set, given as (keyword,
+    category_id), over distinct `descriptions` (`counts`: transactions
+    per description). Columns: hits (transactions the rule categorizes),
+    matches (transactions it matches at all), time_ms (to evaluate it on
+    every description), shadowed_by (the earlier rule winning most of
+    its matches, when it never wins itself), problem (disabled_reason)
+    and disabled (the rule is skipped, see `active_rules`).
+    """
+    texts = pd.Series(descriptions, dtype=object).reset_index(drop=True)
+    lowered = texts.str.lower()
+    weights = np.ones(len(texts), dtype=np.int64)
+    if counts is not None:
+        weights = np.asarray(counts, dtype=np.int64)
+
+    rules = list(rules)
+    hit_matrix = np.zeros((len(rules), len(texts)), dtype=bool)
+    timings, problems = [], []
+    active = {pos for pos, _, _ in active_rules(rules)}
+    for i, (keyword, _) in enumerate(rules):
+        start = time.perf_counter()
+        if i in active:
+            hit_matrix[i] = _contains(keyword, texts, lowered)
+        timings.append((time.perf_counter() - start) * 1000)
+        problems.append(disabled_reason(keyword))
+
+    # First matching rule per description (-1: none)
+    winner = np.full(len(texts), -1)
+    if rules:
+        matched = hit_matrix.any(axis=0)
+        winner = np.where(matched, hit_matrix.argmax(axis=0), -1)
+
+    rows = []
+    for i, (keyword, category_id) in enumerate(rules):
+        wins = winner == i
+        shadowed_by = None
+        if hit_matrix[i].any() and not wins.any():
+            takers = np.bincount(winner[hit_matrix[i]], weights=weights[hit_matrix[i]])
+            shadowed_by = rules[int(takers.argmax())][0]
+        rows.append(
+            {
+                "keyword": keyword,
+                "category_id": category_id,
+                "hits": int(weights[wins].sum()),
+                "matches": int(weights[hit_matrix[i]].sum()),
+                "time_ms": timings[i],
+                "shadowed_by": shadowed_by,
+                "problem": problems[i],
+                "disabled": problems[i] is not None,
+            }
+        )
+    return pd.DataFrame(
+        rows,
+        columns=[
+            "keyword",
+            "category_id",
+            "hits",
+            "matches",
+            "time_ms",
+            "shadowed_by",
+            "problem",
+            "disabled",
+        ],
+    )
+
+
+# --- DRY RUN ---
+class DryRun(NamedTuple):
+    changed: int  # transactions whose category would change
+    per_rule: pd.DataFrame  # keyword, category_id, hits, changes, problem
+    samples: pd.DataFrame  # description, count, category_id, new_category_id, keyword
+
+
+def first_matches(rules, descriptions):
+    """
+    Position of the first rule in `rules` matching each description, or
+    -1. Each rule is tested, vectorized, only on the descriptions no
+    earlier rule has claimed, so the work shrinks as rules match.
+    Disabled rules are left out, as in the rule engine (`active_rules`).
+    """
+    texts = pd.Series(descriptions, dtype=object).reset_index(drop=True)
+    lowered = texts.str.lower()
+    winner = np.full(len(texts), -1)
+    open_rows = np.arange(len(texts))
+    for pos, keyword, _ in active_rules(rules):
+        if not len(open_rows):
+            break
+        hits = _contains(keyword, texts.iloc[open_rows], lowered.iloc[open_rows])
+        winner[open_rows[hits]] = pos
+        open_rows = open_rows[~hits]
+    return winner
+
+
+def dry_run(rules, groups, sample_size=5):
+    """
+    What applying `rules`, as (keyword, category_id) in priority order,
+    to the history would do, without writing anything. `groups` has one
+    row per (description, category_id) with its transaction count (see
+    queries.description_categories). Like "Apply Rules", rows no rule
+    matches keep their category.
+    """
+    rules = list(rules)
+    descriptions = groups["description"].drop_duplicates().reset_index(drop=True)
+    winner = pd.Series(first_matches(rules, descriptions), index=descriptions)
+
+    plan = groups.assign(rule=groups["description"].map(winner).to_numpy())
+    plan = plan[plan["rule"] >= 0]
+    categories = np.array([cat for _, cat in rules] or [0])
+    plan = plan.assign(new_category_id=categories[plan["rule"].to_numpy()])
+    changes = plan[plan["new_category_id"] != plan["category_id"]]
+
+    per_rule = pd.DataFrame(
+        {
+            "keyword": [kw for kw, _ in rules],
+            "category_id": [cat for _, cat in rules],
+            "hits": plan.groupby("rule")["count"].sum(),
+            "changes": changes.groupby("rule")["count"].sum(),
+            "problem": [disabled_reason(kw) for kw, _ in rules],
+        },
+        index=range(len(rules)),
+    )
+    per_rule[["hits", "changes"]] = per_rule[["hits", "changes"]].fillna(0).astype(int)
+
+    samples = (
+        changes.sort_values(["rule", "count"], ascending=[True, False])
+        .groupby("rule")
+        .head(sample_size)
+    )
+    samples = samples.assign(keyword=per_rule["keyword"].to_numpy()[samples["rule"]])
+    return DryRun(
+        int(changes["count"].sum()),
+        per_rule,
+        samples[
+            ["description", "count", "category_id", "new_category_id", "keyword"]
+        ].reset_index(drop=True),
+    )
@@ -0,0 +1,254 @@
+import re
+
+from sqlalchemy import and_, bindparam, select, text
+from sqlalchemy.exc import OperationalError
+
+from src.models import Transaction
+
+# Rows returned by a search box when the caller does not ask for more
+SEARCH_LIMIT = 200
+
+FTS_TABLE = "transaction_fts"
+
+# External-content FTS5 index over "transaction".description: the text
+# lives once, in the real table, and triggers keep the index in step.
+# Prefix indexes make "amaz*" style lookups as cheap as whole words.
+FTS_DDL = f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        description,
+        content="transaction",
+        content_rowid="id",
+        tokenize="unicode61 remove_diacritics 2",
+        prefix="2 3"
+    )
+"""
+
+_INSERT_NEW = f"""
+    INSERT INTO {FTS_TABLE} (rowid, description) VALUES (NEW.id, NEW.description);
+"""
+_DELETE_OLD = f"""
+    INSERT INTO {FTS_TABLE} ({FTS_TABLE}, rowid, description)
+    VALUES ('delete', OLD.id, OLD.description);
+"""
+
+TRIGGERS = {
+    "trg_fts_insert": f"""
+        CREATE TRIGGER IF NOT EXISTS trg_fts_insert
+        AFTER INSERT ON "transaction"
+        BEGIN {_INSERT_NEW} END
+    """,
+    "trg_fts_delete": f"""
+        CREATE TRIGGER IF NOT EXISTS trg_fts_delete
+        AFTER DELETE ON "transaction"
+        BEGIN {_DELETE_OLD} END
+    """,
+    "trg_fts_update": f"""
+        CREATE TRIGGER IF NOT EXISTS trg_fts_update
+        AFTER UPDATE OF description ON "transaction"
+        BEGIN {_DELETE_OLD} {_INSERT_NEW} END
+    """,
+}
+
+_fts_state = {}  # database url -> whether the index exists
+
+
+# --- SCHEMA ---
+def install_triggers(conn):
+    """
+    Creates the index and its triggers. SQLite builds without FTS5 keep
+    working: searches then fall back to LIKE scans.
+    """
+    try:
+        conn.execute(text(FTS_DDL))
+    except OperationalError:
+        return False
+    for ddl in TRIGGERS.values():
+        conn.execute(text(ddl))
+    return True
+
+
+def rebuild_fts(conn):
+    """Re-reads every description into the index."""
+    if has_fts(conn):
+        conn.execute(text(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('rebuild')"))
+
+
+def has_fts(conn):
+    return (
+        conn.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+            {"name": FTS_TABLE},
+        ).first()
+        is not None
+    )
+
+
+def fts_enabled(session):
+    url = str(session.get_bind().url)
+    if url not in _fts_state:
+        _fts_state[url] = has_fts(session.connection())
+    return _fts_state[url]
+
+
+# --- QUERIES ---
+def search_terms(query):
+    """Words of a search box entry, and whether it was quoted as a phrase."""
+    query = query.strip()
+    phrase = len(query) > 1 and query[0] == query[-1] == '"'
+    return re.findall(r"\w+", query), phrase
+
+
+def to_match_query(query):
+    """
+    FTS5 MATCH expression for a search box entry: every word as a prefix
+    ("amaz mkt" finds "AMAZON MKTPLACE"), or an exact phrase when the
+    entry is wrapped in double quotes. None if there is nothing to match.
+    """
+    words, phrase = search_terms(query)
+    if not words:
+        return None
+    if phrase:
+        return '"' + " ".join(words) + '"'
+    return " ".join(f'"{w}"*' for w in words)
+
+
+def matches(session, query):
+    """
+    WHERE clause selecting transactions whose description matches `query`
+    (see `to_match_query`), or None for an empty query.
+    """
+    words, phrase = search_terms(query)
+    if not words:
+        return None
+    if not fts_enabled(session):
+        if phrase:
+            return Transaction.description.contains(" ".join(words), autoescape=True)
+        return and_(
+            *(Transaction.description.contains(w, autoescape=True) for w in words)
+        )
+
+    fts_ids = (
+        select(text("rowid"))
+        .select_from(text(FTS_TABLE))
+        .where(
+            # unique: several searches may share one statement
+            text(f"{FTS_TABLE} MATCH :match_query").bindparams(
+                bindparam("match_query", to_match_query(query), unique=True)
+            )
+        )
+    )
+    return Transaction.id.in_(fts_ids)
+
+
+def description_filter(session, query, regex=False):
+    """
+    WHERE clause for a description search box, or None when it is empty.
+    In regex mode the index first narrows the rows to those containing
+    the pattern's literal words (see `regex_terms`), and SQLite's REGEXP
+    (registered by SQLAlchemy's pysqlite dialect) runs on the rest only.
+    """
+    if not regex:
+        return matches(session, query)
+    if not query:
+        return None
+    # The dialect's REGEXP takes no flags argument; inline flags are allowed
+    clause = Transaction.description.regexp_match(case_insensitive(query))
+    prefilter = matches(session, " ".join(regex_terms(query)))
+    return clause if prefilter is None else and_(prefilter, clause)
+
+
+# --- REGEX PRE-FILTER ---
+def case_insensitive(pattern):
+    return "(?i)" + pattern
+
+
+def regex_error(pattern):
+    """Why `pattern` cannot be used as a description filter, or None."""
+    try:
+        re.compile(case_insensitive(pattern))
+    except re.error as e:
+        # Not str(e): its position would count the added flag
+        return e.msg
+    return None
+
+
+_QUANTIFIERS = "?*{"
+_CLASS_ESCAPES = set("dDwWSAZB")
+_FLAGS = re.compile(r"\(\?[aiLmsu-]+\)")
+
+
+def regex_terms(pattern):
+    """
+    Literal words that every match of `pattern` must contain at the start
+    of a word, so an FTS prefix query on them returns a superset of the
+    rows the regex can match. Conservative: alternations, groups, classes
+    and mid-word literals contribute nothing, and an empty list means the
+    regex has to run over all candidates.
+    """
+    if "|" in pattern or re.search(r"\(\?[a-zA-Z]*x", pattern):
+        return []
+
+    terms = []
+    run, run_ok = "", False
+    # Whether the next literal must start a word. An unanchored pattern
+    # can match mid-word, so only ^, \b and separators set this.
+    boundary = False
+    i = 0
+
+    def close(keep_last=True):
+        nonlocal run
+        word = run if keep_last else run[:-1]
+        if run_ok and len(word) >= 2:
+            terms.append(word)
+        run = ""
+
+    while i < len(pattern):
+        ch = pattern[i]
+        if ch.isalnum():
+            if not run:
+                run_ok = boundary
+            run += ch
+            boundary = False
+            i += 1
+            continue
+
+        # Anything else ends the current run
+        optional = ch in _QUANTIFIERS
+        close(keep_last=not optional)
+
+        if ch == "\\" and i + 1 < len(pattern):
+            nxt = pattern[i + 1]
+            # \b, \s and escaped punctuation separate words; \w, \d... do not
+            boundary = nxt in "bs" or not (nxt.isalnum() or nxt in _CLASS_ESCAPES)
+            i += 2
+        elif _FLAGS.match(pattern, i):
+            # Inline flags such as (?i) match nothing themselves
+            i = _FLAGS.match(pattern, i).end()
+        elif ch in "([":
+            # Skip the whole group or class: it may be optional
+            depth, closer = 1, ")" if ch == "(" else "]"
+            i += 1
+            while i < len(pattern) and depth:
+                if pattern[i] == "\\":
+                    i += 1
+                elif pattern[i] == ch and ch == "(":
+                    depth += 1
+                elif pattern[i] == closer:
+                    depth -= 1
+                i += 1
+            boundary = False
+        elif ch == "{":
+            i = pattern.find("}", i) + 1 or len(pattern)
+            boundary = False
+        elif ch == "^":
+            boundary = True
+            i += 1
+        elif ch in ".$?*+":
+            boundary = False
+            i += 1
+        else:
+            # Literal punctuation or whitespace
+            boundary = True
+            i += 1
+    close()
+    return terms
@@ -0,0 +1,81 @@
+from sqlmodel import text
+
+# Triggers keep monthly_summary in step with every write to "transaction",
+# whichever page or bulk statement makes it. Missing accounts and
+# categories are stored as 0 so the primary key never holds NULL.
+_KEY_COLUMNS = "month, account_id, category_id, is_virtual"
+
+
+def _key(row):
+    return (
+        f"substr({row}.date, 1, 7), IFNULL({row}.account_id, 0), "
+        f"IFNULL({row}.category_id, 0), {row}.is_virtual"
+    )
+
+
+def _match(row):
+    return (
+        f"month = substr({row}.date, 1, 7) "
+        f"AND account_id = IFNULL({row}.account_id, 0) "
+        f"AND category_id = IFNULL({row}.category_id, 0) "
+        f"AND is_virtual = {row}.is_virtual"
+    )
+
+
+_ADD_NEW = f"""
+    INSERT INTO monthly_summary ({_KEY_COLUMNS}, income, spend, tx_count)
+    VALUES ({_key("NEW")}, MAX(NEW.amount, 0), MIN(NEW.amount, 0), 1)
+    ON CONFLICT ({_KEY_COLUMNS}) DO UPDATE SET
+        income = income + excluded.income,
+        spend = spend + excluded.spend,
+        tx_count = tx_count + 1;
+"""
+
+_REMOVE_OLD = f"""
+    UPDATE monthly_summary SET
+        income = income - MAX(OLD.amount, 0),
+        spend = spend - MIN(OLD.amount, 0),
+        tx_count = tx_count - 1
+    WHERE {_match("OLD")};
+    DELETE FROM monthly_summary WHERE {_match("OLD")} AND tx_count <= 0;
+"""
+
+TRIGGERS = {
+    "trg_summary_insert": f"""
+        CREATE TRIGGER IF NOT EXISTS trg_summary_insert
+        AFTER INSERT ON "transaction"
+        BEGIN {_ADD_NEW} END
+    """,
+    "trg_summary_delete": f"""
+        CREATE TRIGGER IF NOT EXISTS trg_summary_delete
+        AFTER DELETE ON "transaction"
+        BEGIN {_REMOVE_OLD} END
+    """,
+    "trg_summary_update": f"""
+        CREATE TRIGGER IF NOT EXISTS trg_summary_update
+        AFTER UPDATE OF date, amount, account_id, category_id, is_virtual
+        ON "transaction"
+        BEGIN {_REMOVE_OLD} {_ADD_NEW} END
+    """,
+}
+
+
+def install_triggers(conn):
+    for ddl in TRIGGERS.values():
+        conn.execute(text(ddl))
+
+
+def rebuild_monthly_summary(conn):
+    """Recomputes the whole table from "transaction". Use it to repair drift."""
+    conn.execute(text("DELETE FROM monthly_summary"))
+    conn.execute(
+        text(
+            f"""
+            INSERT INTO monthly_summary ({_KEY_COLUMNS}, income, spend, tx_count)
+            SELECT {_key('"transaction"')},
+                   SUM(MAX(amount, 0)), SUM(MIN(amount, 0)), COUNT(*)
+            FROM "transaction"
+            GROUP BY 1, 2, 3, 4
+            """
+        )
+    )
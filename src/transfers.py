@@ -0,0 +1,250 @@
+from datetime import timedelta
+
+import pandas as pd
+from sqlalchemy import insert, or_, union
+from sqlmodel import func, select
+
+from src import mutations, queries
+from src.cache import cached
+from src.models import Category, Transaction, TransferLink, Watermark
+from src.money import SCALE
+
+# Default matching rules: an incoming and an outgoing transaction are a
+# transfer pair when their amounts differ by at most TOLERANCE (currency
+# units) and their dates by at most WINDOW_DAYS.
+WINDOW_DAYS = 3
+TOLERANCE = 0.0
+
+SIDE_COLUMNS = ["id", "date", "description", "amount", "account_id"]
+PAIR_COLUMNS = (
+    [f"in_{c}" for c in SIDE_COLUMNS]
+    + [f"out_{c}" for c in SIDE_COLUMNS]
+    + ["delta_days"]
+)
+
+# Watermark row: transactions up to this id have been through detection
+SCAN_WATERMARK = "transfer_scan"
+
+
+# --- MATCHING ---
+def _cells(tx, prefix, window_days, tol_units):
+    """
+    `tx` with its minor units, day number and grid cell. Cells are one
+    tolerance wide and one window long, so a matching pair always lies in
+    the same or a neighbouring cell.
+    """
+    side = tx[SIDE_COLUMNS].copy()
+    side["units"] = (side["amount"].abs() * SCALE).round().astype("int64")
+    side["day"] = side["date"].values.astype("datetime64[D]").astype("int64")
+    side["acell"] = side["units"] // (tol_units + 1)
+    side["dcell"] = side["day"] // (window_days + 1)
+    return side.add_prefix(prefix)
+
+
+def find_transfers(tx, window_days=WINDOW_DAYS, tolerance=TOLERANCE, since_id=0):
+    """
+    Pairs incoming with outgoing transactions of the same absolute amount
+    (within `tolerance`) and at most `window_days` apart, each transaction
+    in at most one pair. `tx` is a frame as returned by queries.transactions.
+    With `since_id`, only pairs with a transaction above that id are kept.
+
+    Candidates come from a hash join on an (amount, date) grid, so the work
+    grows with the number of rows and their near neighbours, not with all
+    incoming x outgoing combinations. Pairs are then taken greedily, best
+    first: other account over same account, then closest date, closest
+    amount and lowest ids, so the result never depends on row order.
+    """
+    tol_units = int(round(tolerance * SCALE))
+    incoming = _cells(tx[tx["amount"] > 0], "in_", window_days, tol_units)
+    outgoing = _cells(tx[tx["amount"] < 0], "out_", window_days, tol_units)
+    if incoming.empty or outgoing.empty:
+        return pd.DataFrame(columns=PAIR_COLUMNS)
+
+    amount_steps = (-1, 0, 1) if tol_units else (0,)
+    probes = pd.concat(
+        incoming.assign(
+            acell=incoming["in_acell"] + da, dcell=incoming["in_dcell"] + dd
+        )
+        for da in amount_steps
+        for dd in (-1, 0, 1)
+    )
+    pairs = probes.merge(
+        outgoing.rename(columns={"out_acell": "acell", "out_dcell": "dcell"}),
+        on=["acell", "dcell"],
+    )
+    pairs["delta_days"] = (pairs["in_day"] - pairs["out_day"]).abs()
+    pairs["delta_units"] = (pairs["in_units"] - pairs["out_units"]).abs()
+    pairs = pairs[
+        (pairs["delta_days"] <= window_days) & (pairs["delta_units"] <= tol_units)
+    ]
+    if since_id:
+        pairs = pairs[(pairs["in_id"] > since_id) | (pairs["out_id"] > since_id)]
+    pairs["same_account"] = pairs["in_account_id"].eq(pairs["out_account_id"])
+    pairs = pairs.sort_values(
+        ["same_account", "delta_days", "delta_units", "in_id", "out_id"]
+    ).reset_index(drop=True)
+
+    used_in, used_out, keep = set(), set(), []
+    for pos, in_id, out_id in zip(pairs.index, pairs["in_id"], pairs["out_id"]):
+        if in_id not in used_in and out_id not in used_out:
+            used_in.add(in_id)
+            used_out.add(out_id)
+            keep.append(pos)
+
+    return (
+        pairs.loc[keep, PAIR_COLUMNS]
+        .sort_values(["in_date", "in_id"])
+        .reset_index(drop=True)
+    )
+
+
+# --- WATERMARK ---
+def get_watermark(session, name=SCAN_WATERMARK):
+    mark = session.get(Watermark, name)
+    return mark.value if mark else 0
+
+
+def set_watermark(session, value, name=SCAN_WATERMARK):
+    mark = session.get(Watermark, name) or Watermark(name=name)
+    mark.value = value
+    session.add(mark)
+
+
+def last_transaction_id(session):
+    return session.exec(select(func.max(Transaction.id))).one() or 0
+
+
+# --- DETECTION ---
+def _linked_ids():
+    return union(
+        select(TransferLink.outgoing_tx_id), select(TransferLink.incoming_tx_id)
+    )
+
+
+@cached()
+def detect_transfers(
+    session,
+    transfer_category_id,
+    window_days=WINDOW_DAYS,
+    tolerance=TOLERANCE,
+    since_id=0,
+):
+    """
+    Transfer pairs among the unlinked transactions outside the Transfer
+    category. With `since_id` (usually the scan watermark) only the newer
+    transactions are matched, against the older ones dated within the
+    window of them, so a rescan reads a few rows instead of the history.
+    """
+    unlinked = [
+        or_(
+            Transaction.category_id == None,
+            Transaction.category_id != transfer_category_id,
+        ),
+        Transaction.id.not_in(_linked_ids()),
+    ]
+    tx = queries.transactions(session, *unlinked, Transaction.id > since_id)
+    if since_id and not tx.empty:
+        window = timedelta(days=window_days)
+        older = queries.transactions(
+            session,
+            *unlinked,
+            Transaction.id <= since_id,
+            Transaction.date >= tx["date"].min().date() - window,
+            Transaction.date <= tx["date"].max().date() + window,
+        )
+        if not older.empty:
+            tx = pd.concat([tx, older], ignore_index=True)
+    return find_transfers(tx, window_days, tolerance, since_id)
+
+
+# --- LINKING ---
+# These write through src/mutations.py in a few bulk statements; the
+# caller commits.
+def _categories(session, ids):
+    statement = select(Transaction.id, Transaction.category_id).where(
+        Transaction.id.in_(ids)
+    )
+    return dict(session.exec(statement).all())
+
+
+def link_pairs(session, pairs, transfer_category_id, method="auto"):
+    """
+    Records each (outgoing_id, incoming_id, delta_days) pair as one
+    transfer and moves both sides to the Transfer category.
+    """
+    pairs = [(int(o), int(i), int(d)) for o, i, d in pairs]
+    if not pairs:
+        return 0
+    ids = [tx_id for o, i, _ in pairs for tx_id in (o, i)]
+    previous = _categories(session, ids)
+    session.execute(
+        insert(TransferLink),
+        [
+            {
+                "outgoing_tx_id": o,
+                "incoming_tx_id": i,
+                "delta_days": d,
+                "method": method,
+                "outgoing_prev_category_id": previous.get(o),
+                "incoming_prev_category_id": previous.get(i),
+            }
+            for o, i, d in pairs
+        ],
+    )
+    mutations.set_value(session, Transaction.category_id, ids, transfer_category_id)
+    return len(pairs)
+
+
+def link_pair(session, tx_a, tx_b, transfer_category_id, method="manual"):
+    """Links two transactions; the lower amount is the outgoing side."""
+    outgoing, incoming = sorted((tx_a, tx_b), key=lambda t: (t.amount, t.id))
+    delta_days = abs((incoming.date - outgoing.date).days)
+    return link_pairs(
+        session, [(outgoing.id, incoming.id, delta_days)], transfer_category_id, method
+    )
+
+
+def is_linked(session, tx_id):
+    statement = select(TransferLink.id).where(
+        or_(TransferLink.outgoing_tx_id == tx_id, TransferLink.incoming_tx_id == tx_id)
+    )
+    return session.exec(statement).first() is not None
+
+
+def unlink(session, link_ids, transfer_category_id):
+    """
+    Deletes these links and gives both sides of each their category from
+    before linking, unless it was changed since. A category deleted in
+    the meantime becomes Uncategorized.
+    """
+    links = session.exec(
+        select(TransferLink).where(TransferLink.id.in_(link_ids))
+    ).all()
+    restore = {}
+    for link in links:
+        restore[link.outgoing_tx_id] = link.outgoing_prev_category_id
+        restore[link.incoming_tx_id] = link.incoming_prev_category_id
+    existing = set(
+        session.exec(
+            select(Category.id).where(Category.id.in_(set(restore.values())))
+        ).all()
+    )
+    if not existing.issuperset(filter(None, restore.values())):
+        fallback = session.exec(
+            select(Category.id).where(Category.name == "Uncategorized")
+        ).first()
+        restore = {
+            tx_id: prev if prev is None or prev in existing else fallback
+            for tx_id, prev in restore.items()
+        }
+    current = _categories(session, list(restore))
+    mutations.update_values(
+        session,
+        Transaction.category_id,
+        {
+            tx_id: prev
+            for tx_id, prev in restore.items()
+            if current.get(tx_id) == transfer_category_id
+        },
+    )
+    return mutations.delete_rows(session, [link.id for link in links], TransferLink)
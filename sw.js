@@ -7,6 +7,22 @@ const ASSETS_TO_CACHE = [
   "./src/database.py",
   "./src/models.py",
   "./src/analytics.py",
+  "./src/importer.py",
+  "./src/rules.py",
+  "./src/dates.py",
+  "./src/migrations.py",
+  "./src/config.py",
+  "./src/money.py",
+  "./src/summary.py",
+  "./src/balances.py",
+  "./src/queries.py",
+  "./src/cache.py",
+  "./src/search.py",
+  "./src/transfers.py",
+  "./src/mutations.py",
+  "./src/recategorize.py",
+  "./src/merchants.py",
+  "./src/classifier.py",
   "./pages/1_Import_Data.py",
   "./pages/2_Budget_Planner.py",
   "./pages/3_Transaction_Manager.py",